@@ -42,6 +42,11 @@ def create_access_token(subject: str, role: RoleEnum, expires_delta: Optional[ti
 def get_current_user(
     token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)
 ) -> User:
+    return user_from_token(session, token)
+
+
+def user_from_token(session: Session, token: str) -> User:
+    """Resolve a bearer token outside the dependency system (e.g. for WebSocket handshakes)."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -13,6 +13,53 @@ class Settings(BaseSettings):
     database_url: str = Field("sqlite:///./attendance.db", env="DATABASE_URL")
     credentials_database_url: str = Field("sqlite:///./credentials.db", env="CREDENTIALS_DATABASE_URL")
     default_password_length: int = 10
+    face_gallery_ttl_seconds: int = 300
+    face_gallery_dir: str = ""  # e.g. ./face_galleries: memory-mapped offering galleries shared by all workers (POSIX); "" = one copy per process
+    attendance_refresh_seconds: int = 300  # how often a repeat recognition rewrites detected_at; 0 = every time
+    attendance_label_ttl_seconds: int = 600  # cached student names/ids are re-read after this, so edits from other workers show up
+    face_inference_workers: int = 2
+    face_inference_queue_depth: int = 8
+    face_opencv_threads: int = 0  # 0 = split the CPU count evenly across inference workers
+    face_inference_backend: str = "opencv"  # runtime for SFace: opencv (cv2.dnn) or onnxruntime
+    face_inference_mode: str = "inprocess"  # inprocess, or worker: run face_service in app.face_worker processes
+    face_worker_socket: str = "./face_worker.sock"  # Unix socket the face worker listens on
+    face_worker_processes: int = 1  # processes started by python -m app.face_worker, each with face_inference_workers threads
+    face_worker_timeout_seconds: float = 30.0
+    face_warm_up_on_startup: bool = False  # load OpenCV and the models at startup instead of on the first face request
+    face_ort_intra_op_threads: int = 0  # ONNX Runtime threads per run; 0 = its default
+    face_ort_inter_op_threads: int = 0  # > 1 also enables parallel execution of graph branches
+    face_ort_graph_optimization: str = "all"  # disable, basic, extended or all
+    face_detect_max_side: int = 640  # longest side of the image YuNet sees for single-face frames
+    face_classroom_detect_max_side: int = 1280
+    face_detect_top_k: int = 500
+    face_max_image_bytes: int = 5 * 1024 * 1024  # per uploaded image, checked before the body is read
+    face_capture_max_images: int = 10
+    face_enroll_samples: int = 3  # best-quality frames of a capture burst that are embedded and stored
+    face_enroll_early_stop: int = 5  # stop processing a burst once this many frames passed the quality gate
+    face_reduced_decode_bytes: int = 1_000_000  # JPEGs above this are decoded at 1/2 (or 1/4 above 4x) scale; 0 disables
+    face_quality_gate: bool = True  # reject tiny, turned, blurred or badly lit faces before recognition
+    face_min_face_px: int = 48
+    face_max_yaw_ratio: float = 0.6  # nose offset from the eye midline, 0 = frontal, 1 = profile
+    face_min_sharpness: float = 25.0  # Laplacian variance of the 64x64 face patch
+    face_min_brightness: int = 40
+    face_max_brightness: int = 220
+    face_batch_max_size: int = 8  # crops from concurrent requests sharing one SFace forward pass
+    face_batch_max_wait_ms: float = 4.0  # longest a batch waits for requests still in detection
+    face_probe_cache_size: int = 256  # recent single-face results kept by image hash; 0 disables
+    face_probe_cache_ttl_seconds: int = 120
+    face_templates_per_student: int = 5  # enrollment templates kept per student in a gallery; 0 = all
+    face_template_top_k: int = 1  # 1 = score by best template; k > 1 = mean of the best k
+    face_image_store_dir: str = "./face_images"
+    face_thumbnail_size: int = 160
+    face_review_retention_days: int = 30  # preview images are deleted this long after a request is decided
+    face_image_url_ttl_seconds: int = 3600  # signed preview URLs stay valid for 1-2x this long
+    face_index_path: str = "./face_index.npz"
+    face_index_nlist: int = 0  # IVF lists; 0 = sqrt(number of templates)
+    face_index_nprobe: int = 8  # lists scanned per query; higher = better recall, slower
+    face_index_exact_below: int = 5000  # templates below which the index is a plain exact scan
+    face_vector_precision: str = "float32"  # galleries and index in memory: float32, int8 (1/4 RAM) or float16 (1/2 RAM, slowest)
+    face_vector_rerank: int = 32  # with float16/int8, best template scores per probe rescored from dequantized rows with a float32 probe; 0 = off
+    face_duplicate_threshold: float = 0.50  # a new face scoring this close to another user's is sent to review
     curriculum_map: Dict[Tuple[str, int], List[str]] = {
         ("COE", 3): [
             "Computer Networks",
@@ -1,14 +1,20 @@
 import secrets
 import string
-from datetime import datetime
-from typing import List, Optional, Type
+import threading
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, List, Optional, Tuple, Type
 
 from fastapi import HTTPException, status
-from sqlmodel import Session, select
+from sqlalchemy import event, inspect, true
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session, func, or_, select
 
 from .auth import hash_password
 from .config import get_settings
 from .credential_store import record_credentials
+from .gallery_store import gallery_store
+from .image_store import face_image_store
+from .inference import loaded_face_service
 from .models import (
     AttendanceRecord,
     AttendanceSession,
@@ -19,6 +25,8 @@ from .models import (
     CourseRequest,
     CourseRequestStatus,
     Enrollment,
+    FaceEmbedding,
+    FaceUpdateRequest,
     LoginBase,
     RoleEnum,
     StudentProfile,
@@ -27,8 +35,13 @@ from .models import (
     User,
     StudentLogin,
 )
+from .presence import attendance_presence
 from .schemas import AttendanceSummaryItem
 
+if TYPE_CHECKING:
+    from .face_index import FaceIndex
+    from .face_service import FaceGallery
+
 settings = get_settings()
 
 
@@ -77,13 +90,14 @@ def generate_student_id(branch: str, year: int, session: Session) -> str:
 
 
 def ensure_curriculum_courses(session: Session) -> None:
-    for (branch, year), names in settings.curriculum_map.items():
-        for name in names:
-            code = f"{branch.upper()}{year}-{name.split()[0].upper()}"
-            existing = session.exec(select(Course).where(Course.code == code)).first()
-            if not existing:
-                course = Course(code=code, name=name, branch=branch, year=year)
-                session.add(course)
+    # One INSERT .. ON CONFLICT DO NOTHING for the whole curriculum instead of a SELECT per course
+    rows = [
+        {"code": f"{branch.upper()}{year}-{name.split()[0].upper()}", "name": name, "branch": branch, "year": year}
+        for (branch, year), names in settings.curriculum_map.items()
+        for name in names
+    ]
+    if rows:
+        session.execute(sqlite_insert(Course).values(rows).on_conflict_do_nothing(index_elements=["code"]))
     session.commit()
 
 
@@ -133,12 +147,14 @@ def create_student(session: Session, email: str, full_name: str, branch: str, ye
     session.flush()
 
     ensure_curriculum_courses(session)
-    auto_enroll_student(session, student)
+    offering_ids = auto_enroll_student(session, student)
     session.commit()
+    for offering_id in offering_ids:
+        invalidate_face_galleries(offering_id)
     return {"user": user, "student": student, "password": temp_password}
 
 
-def auto_enroll_student(session: Session, student: StudentProfile) -> None:
+def auto_enroll_student(session: Session, student: StudentProfile) -> List[int]:
     offerings = session.exec(
         select(CourseOffering)
         .join(Course)
@@ -146,6 +162,7 @@ def auto_enroll_student(session: Session, student: StudentProfile) -> None:
         .where(Course.year == student.year)
     ).all()
 
+    enrolled: List[int] = []
     for offering in offerings:
         exists = session.exec(
             select(Enrollment)
@@ -154,6 +171,8 @@ def auto_enroll_student(session: Session, student: StudentProfile) -> None:
         ).first()
         if not exists:
             session.add(Enrollment(offering_id=offering.id, student_id=student.id))
+            enrolled.append(offering.id)
+    return enrolled
 
 
 def enroll_existing_students(session: Session, offering: CourseOffering) -> None:
@@ -194,6 +213,7 @@ def create_course_offering(session: Session, course_code: str, teacher_id: str,
     session.flush()
     enroll_existing_students(session, offering)
     session.commit()
+    invalidate_face_galleries(offering.id)
     session.refresh(offering)
     return offering
 
@@ -231,6 +251,7 @@ def close_attendance_session(session: Session, session_id: int) -> AttendanceSes
     attendance_session.end_time = datetime.utcnow()
     session.add(attendance_session)
     session.commit()
+    attendance_presence.forget_session(session_id)
     session.refresh(attendance_session)
     return attendance_session
 
@@ -260,10 +281,287 @@ def record_detection(session: Session, attendance_session_id: int, student_ident
         )
         session.add(record)
     session.commit()
+    attendance_presence.mark(attendance_session_id, [student.id])
     session.refresh(record)
     return record
 
 
+def record_detections(
+    session: Session, attendance_session_id: int, detections: List[tuple[int, Optional[float]]]
+) -> List[AttendanceRecord]:
+    """Mark several students (by StudentProfile id) present in a single transaction."""
+    attendance_session = session.get(AttendanceSession, attendance_session_id)
+    if not attendance_session or not attendance_session.active:
+        raise HTTPException(status_code=400, detail="Session is not active")
+    if not detections:
+        return []
+    existing = {
+        record.student_id: record
+        for record in session.exec(
+            select(AttendanceRecord)
+            .where(AttendanceRecord.session_id == attendance_session_id)
+            .where(AttendanceRecord.student_id.in_([student_id for student_id, _ in detections]))
+        ).all()
+    }
+    now = datetime.utcnow()
+    records = []
+    for student_id, confidence in detections:
+        record = existing.get(student_id)
+        if record:
+            record.detected_at = now
+            record.status = AttendanceStatus.PRESENT
+            record.confidence = confidence
+        else:
+            record = AttendanceRecord(
+                session_id=attendance_session_id,
+                student_id=student_id,
+                detected_at=now,
+                confidence=confidence,
+            )
+        session.add(record)
+        records.append(record)
+    session.commit()
+    attendance_presence.mark(attendance_session_id, [student_id for student_id, _ in detections])
+    return records
+
+
+@event.listens_for(StudentProfile, "after_update")
+def _forget_changed_student_label(mapper, connection, target: StudentProfile) -> None:
+    if inspect(target).attrs.student_id.history.has_changes():
+        attendance_presence.forget_labels([target.id])
+
+
+@event.listens_for(User, "after_update")
+def _forget_renamed_student_label(mapper, connection, target: User) -> None:
+    if inspect(target).attrs.full_name.history.has_changes():
+        student_pk = connection.execute(select(StudentProfile.id).where(StudentProfile.user_id == target.id)).scalar()
+        if student_pk is not None:
+            attendance_presence.forget_labels([student_pk])
+
+
+def student_labels(session: Session, student_pks: List[int]) -> dict[int, tuple[str, str]]:
+    """(student_id, full name) per StudentProfile id, cached so repeat recognitions skip the lookup."""
+    labels = {pk: attendance_presence.label(pk) for pk in student_pks}
+    missing = [pk for pk, label in labels.items() if label is None]
+    if missing:
+        fetched = {
+            pk: (student_code, full_name)
+            for pk, student_code, full_name in session.exec(
+                select(StudentProfile.id, StudentProfile.student_id, User.full_name)
+                .join(User, User.id == StudentProfile.user_id)
+                .where(StudentProfile.id.in_(missing))
+            ).all()
+        }
+        attendance_presence.remember_labels(fetched)
+        labels.update(fetched)
+    return labels
+
+
+def load_offering_gallery(session: Session, offering_id: int) -> "FaceGallery":
+    from .face_service import FaceGallery, embedding_templates
+
+    rows = session.exec(
+        select(Enrollment.student_id, FaceEmbedding.embedding)
+        .join(StudentProfile, StudentProfile.id == Enrollment.student_id)
+        .join(FaceEmbedding, FaceEmbedding.user_id == StudentProfile.user_id)
+        .where(Enrollment.offering_id == offering_id)
+    ).all()
+    templates: dict[int, object] = {}
+    for student_id, embedding in rows:
+        if not embedding or student_id in templates:
+            continue
+        templates[student_id] = embedding_templates(embedding, settings.face_templates_per_student)
+    return FaceGallery(
+        list(templates.keys()),
+        list(templates.values()),
+        top_k=settings.face_template_top_k,
+        precision=settings.face_vector_precision,
+        rerank=settings.face_vector_rerank,
+    )
+
+
+def get_offering_gallery(session: Session, offering_id: int) -> "FaceGallery":
+    from .face_service import gallery_cache
+
+    return gallery_cache.get_or_build(offering_id, lambda: load_offering_gallery(session, offering_id))
+
+
+def invalidate_face_galleries(offering_id: Optional[int] = None) -> None:
+    """Drop cached galleries for one offering, or all of them when a face embedding changed."""
+    face_service = loaded_face_service()
+    if face_service is not None:
+        face_service.gallery_cache.invalidate(offering_id)  # includes the shared store
+    elif gallery_store is not None:
+        # Workers that did load face_service still map the shared files
+        gallery_store.invalidate(offering_id)
+
+
+def _face_gallery_signature(session: Session) -> str:
+    # Everything load_offering_gallery reads: enrollments, face templates and the settings that shape them
+    enrollments = session.exec(select(func.count(Enrollment.id), func.max(Enrollment.id))).one()
+    faces = session.exec(select(func.count(FaceEmbedding.id), func.max(FaceEmbedding.captured_at))).one()
+    options = (
+        settings.face_templates_per_student, settings.face_template_top_k,
+        settings.face_vector_precision, settings.face_vector_rerank,
+    )
+    return repr((tuple(enrollments), _index_signature(*faces), options))
+
+
+def sync_face_galleries(session: Session) -> None:
+    """
+    At startup, drop the shared gallery files if the database changed since they were built.
+    A restart after the app's own face changes still drops them once, because those changes
+    invalidate without recording the new state.
+    """
+    if gallery_store is not None:
+        gallery_store.sync(_face_gallery_signature(session))
+
+
+_index_build_lock = threading.Lock()
+# Catching up re-reads rows captured this long before the index's watermark: captured_at is
+# stamped before commit, so a slow writer can land a row older than ones already applied
+INDEX_CATCH_UP_SLACK = timedelta(minutes=5)
+
+
+def _index_signature(count: int, latest: Optional[datetime]) -> str:
+    return f"{count}:{latest.isoformat() if latest else ''}"
+
+
+def _face_index_signature(session: Session) -> str:
+    # Enrollment adds a row and approval bumps captured_at, so this changes whenever any template does
+    count, latest = session.exec(select(func.count(FaceEmbedding.id), func.max(FaceEmbedding.captured_at))).one()
+    return _index_signature(count, latest)
+
+
+def _face_index_rows(session: Session, since: Optional[datetime]) -> Tuple[str, int, List[Tuple[int, bytes]]]:
+    """
+    (signature, row count, [(user_id, embedding)]) for rows captured at or after `since`, or
+    every row when None. One statement, so the rows are exactly the state the signature
+    describes however many writers commit around it.
+    """
+    stats = select(
+        func.count(FaceEmbedding.id).label("count"), func.max(FaceEmbedding.captured_at).label("latest")
+    ).subquery()
+    rows = session.exec(
+        select(stats.c.count, stats.c.latest, FaceEmbedding.user_id, FaceEmbedding.embedding)
+        .select_from(stats)
+        .outerjoin(FaceEmbedding, FaceEmbedding.captured_at >= since if since is not None else true())
+    ).all()
+    count, latest = rows[0][0], rows[0][1]
+    return _index_signature(count, latest), count, [(user_id, blob) for _, _, user_id, blob in rows if blob]
+
+
+def _sync_institution_index(session: Session, institution_index: "FaceIndex") -> None:
+    """
+    Bring the index up to date with FaceEmbedding; call with _index_build_lock held. An index
+    this process hasn't built yet starts from settings.face_index_path. The rows captured since
+    the index's watermark are then applied in place, which covers enrollments made through any
+    process; only when that can't account for the table (rows were deleted, or there is no
+    saved index) is it rebuilt from every row, and the result saved for the other processes.
+    """
+    from .face_service import unpack_embeddings
+
+    if institution_index.signature is None:
+        institution_index.load(settings.face_index_path)
+    if institution_index.signature is not None:
+        watermark = institution_index.signature.split(":", 1)[1]
+        since = datetime.fromisoformat(watermark) - INDEX_CATCH_UP_SLACK if watermark else None
+        signature, count, rows = _face_index_rows(session, since)
+        if signature == institution_index.signature:
+            return
+        for user_id, blob in rows:
+            institution_index.add(user_id, unpack_embeddings(blob))
+        if len(institution_index) == count:
+            institution_index.signature = signature
+            return
+    signature, _, rows = _face_index_rows(session, None)
+    institution_index.build([(user_id, unpack_embeddings(blob)) for user_id, blob in rows])
+    institution_index.signature = signature
+    institution_index.save(settings.face_index_path)
+
+
+def get_institution_index(session: Session) -> "FaceIndex":
+    """The institution-wide face index, kept in sync with FaceEmbedding (see _sync_institution_index)."""
+    from .face_service import institution_index
+
+    if institution_index.signature == _face_index_signature(session):
+        return institution_index
+    with _index_build_lock:
+        _sync_institution_index(session, institution_index)
+    return institution_index
+
+
+def index_face_embedding(session: Session) -> None:
+    """Apply a committed FaceEmbedding change, and any other process's since, to the index without a rebuild."""
+    face_service = loaded_face_service()
+    if face_service is None or face_service.institution_index.signature is None:
+        return  # not built in this process yet; the first search builds it
+    with _index_build_lock:
+        _sync_institution_index(session, face_service.institution_index)
+
+
+def find_duplicate_face(session: Session, user_id: int, embedding: bytes) -> Tuple[Optional[int], Optional[float]]:
+    """
+    The other enrolled user most similar to a new face, as (user_id, score), when any of its
+    templates scores at least settings.face_duplicate_threshold; (None, None) otherwise.
+    One index search per template, so the check stays sublinear in the number of users.
+    """
+    from .face_service import unpack_embeddings
+
+    index = get_institution_index(session)
+    duplicate: Tuple[Optional[int], Optional[float]] = (None, None)
+    for template in unpack_embeddings(embedding):
+        # k=2: the best hit may be the user's own current face when they re-enroll
+        for other_id, score in index.search(template, k=2):
+            if other_id == user_id:
+                continue
+            if score >= settings.face_duplicate_threshold and (duplicate[1] is None or score > duplicate[1]):
+                duplicate = (other_id, score)
+            break
+    return duplicate
+
+
+def purge_face_review_images(session: Session) -> int:
+    """
+    Delete preview images of face update requests decided more than
+    face_review_retention_days ago (or before decisions were timestamped).
+    Files shared with a still-retained request are kept. Returns the number of requests purged.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=settings.face_review_retention_days)
+    expired = session.exec(
+        select(FaceUpdateRequest).where(
+            FaceUpdateRequest.status != "PENDING",
+            or_(FaceUpdateRequest.decided_at.is_(None), FaceUpdateRequest.decided_at < cutoff),
+            or_(FaceUpdateRequest.image_digest.is_not(None), FaceUpdateRequest.image_data != ""),
+        )
+    ).all()
+    if not expired:
+        return 0
+    expired_ids = [request.id for request in expired]
+    digests = {request.image_digest for request in expired if request.image_digest}
+    still_used = set(
+        session.exec(
+            select(FaceUpdateRequest.image_digest).where(
+                FaceUpdateRequest.image_digest.in_(digests), FaceUpdateRequest.id.not_in(expired_ids)
+            )
+        ).all()
+    ) if digests else set()
+    for request in expired:
+        request.image_digest = None
+        request.image_data = ""
+        session.add(request)
+    session.commit()
+    for digest in digests - still_used:
+        face_image_store.delete(digest)
+    return len(expired)
+
+
+def save_institution_index() -> None:
+    face_service = loaded_face_service()
+    if face_service is not None and face_service.institution_index.signature is not None:
+        face_service.institution_index.save(settings.face_index_path)
+
+
 def summarize_attendance(session: Session, student: StudentProfile) -> List[AttendanceSummaryItem]:
     items: List[AttendanceSummaryItem] = []
     enrollments = session.exec(
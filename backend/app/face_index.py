@@ -0,0 +1,250 @@
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from .quantization import QuantizedMatrix, normalize_rows
+
+
+def _spherical_kmeans(vectors: np.ndarray, k: int, iterations: int, seed: int = 0) -> np.ndarray:
+    """k-means on the unit sphere (cosine distance); returns k unit-length centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = ~sums.any(axis=1)
+        if empty.any():
+            # Re-seed empty clusters from random points so no list stays unused
+            sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids.astype(np.float32)
+
+
+class FaceIndex:
+    """
+    Inverted-file (IVF) index over unit-length face templates, keyed by user id.
+
+    Templates are clustered around `nlist` spherical k-means centroids; a search scores only
+    the `nprobe` closest lists, so cost grows with N / nlist * nprobe instead of N. While the
+    index holds fewer than `exact_below` templates it stays a single list, i.e. an exact scan.
+    A user may own several templates; results are per user (best template score).
+    Lists can be stored as float16 or int8 (`precision`), with the best `rerank`
+    candidates of each search rescored from dequantized rows with a float32 probe.
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        nlist: int = 0,
+        nprobe: int = 8,
+        exact_below: int = 5000,
+        kmeans_iterations: int = 10,
+        precision: str = "float32",
+        rerank: int = 0,
+    ):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.exact_below = exact_below
+        self.kmeans_iterations = kmeans_iterations
+        self.precision = precision
+        self.rerank = rerank if precision != "float32" else 0
+        self.centroids: Optional[np.ndarray] = None
+        self._list_ids: List[np.ndarray] = [np.empty(0, dtype=np.int64)]
+        self._list_vectors: List[QuantizedMatrix] = [QuantizedMatrix.empty(dim, precision)]
+        self._lists_by_owner: Dict[int, Set[int]] = {}
+        self._trained_size = 0
+        # Opaque marker of the database state this index reflects (see crud.get_institution_index)
+        self.signature: Optional[str] = None
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._lists_by_owner)
+
+    @property
+    def template_count(self) -> int:
+        return sum(len(ids) for ids in self._list_ids)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the stored templates."""
+        return sum(vectors.nbytes for vectors in self._list_vectors)
+
+    @property
+    def is_exact(self) -> bool:
+        return self.centroids is None
+
+    # --- building -------------------------------------------------------
+
+    def build(self, entries: Sequence[Tuple[int, np.ndarray]]) -> None:
+        """Replace the contents with (owner_id, templates) pairs, training centroids if large enough."""
+        owners = [np.full(len(templates), owner, dtype=np.int64) for owner, templates in entries]
+        ids = np.concatenate(owners) if owners else np.empty(0, dtype=np.int64)
+        vectors = (
+            normalize_rows(np.vstack([np.asarray(t, dtype=np.float32).reshape(-1, self.dim) for _, t in entries]))
+            if entries
+            else np.empty((0, self.dim), dtype=np.float32)
+        )
+        with self._lock:
+            self._fill(ids, vectors.astype(np.float32))
+
+    def _fill(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        if len(ids) < self.exact_below:
+            self.centroids = None
+            assignment = np.zeros(len(ids), dtype=np.int64)
+            nlist = 1
+        else:
+            nlist = self.nlist or max(1, int(np.sqrt(len(ids))))
+            # Training on a sample keeps rebuilds bounded at tens of thousands of templates
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(len(vectors), size=min(len(vectors), nlist * 64), replace=False)]
+            self.centroids = _spherical_kmeans(sample, nlist, self.kmeans_iterations)
+            assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(nlist + 1))
+        self._list_ids = [ids[order[bounds[i]:bounds[i + 1]]] for i in range(nlist)]
+        self._list_vectors = [
+            QuantizedMatrix.encode(vectors[order[bounds[i]:bounds[i + 1]]], self.precision) for i in range(nlist)
+        ]
+        self._lists_by_owner = {}
+        for list_no, list_ids in enumerate(self._list_ids):
+            for owner in np.unique(list_ids):
+                self._lists_by_owner.setdefault(int(owner), set()).add(list_no)
+        self._trained_size = len(ids)
+
+    def _maybe_retrain(self) -> None:
+        size = self.template_count
+        crossed_threshold = self.is_exact and size >= self.exact_below
+        outgrown = not self.is_exact and size > 4 * self._trained_size
+        if crossed_threshold or outgrown:
+            ids = np.concatenate(self._list_ids)
+            vectors = QuantizedMatrix.concat(self._list_vectors).decode()
+            self._fill(ids, vectors)
+
+    # --- incremental updates -------------------------------------------
+
+    def add(self, owner: int, templates: np.ndarray) -> None:
+        """Insert (or replace) all templates of one user."""
+        templates = normalize_rows(np.asarray(templates, dtype=np.float32).reshape(-1, self.dim)).astype(np.float32)
+        with self._lock:
+            self._remove(owner)
+            if self.is_exact:
+                assignment = np.zeros(len(templates), dtype=np.int64)
+            else:
+                assignment = np.argmax(templates @ self.centroids.T, axis=1)
+            for list_no in np.unique(assignment):
+                rows = templates[assignment == list_no]
+                self._list_ids[list_no] = np.concatenate([self._list_ids[list_no], np.full(len(rows), owner, dtype=np.int64)])
+                self._list_vectors[list_no] = QuantizedMatrix.concat(
+                    [self._list_vectors[list_no], QuantizedMatrix.encode(rows, self.precision)]
+                )
+                self._lists_by_owner.setdefault(owner, set()).add(int(list_no))
+            self._maybe_retrain()
+
+    def remove(self, owner: int) -> None:
+        with self._lock:
+            self._remove(owner)
+
+    def _remove(self, owner: int) -> None:
+        for list_no in self._lists_by_owner.pop(owner, set()):
+            keep = self._list_ids[list_no] != owner
+            self._list_ids[list_no] = self._list_ids[list_no][keep]
+            self._list_vectors[list_no] = self._list_vectors[list_no].take(keep)
+
+    # --- search ---------------------------------------------------------
+
+    def search(self, probe: np.ndarray, k: int = 5, nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Top-k users by best template cosine similarity; `nprobe` trades recall for latency."""
+        probe = np.asarray(probe, dtype=np.float32).ravel()
+        norm = np.linalg.norm(probe)
+        if norm == 0:
+            return []
+        probe = probe / norm
+        with self._lock:
+            if self.is_exact:
+                lists = [0]
+            else:
+                probes = min(len(self.centroids), nprobe or self.nprobe)
+                lists = np.argpartition(-(self.centroids @ probe), probes - 1)[:probes]
+            ids = [self._list_ids[i] for i in lists]
+            vectors = [self._list_vectors[i] for i in lists]
+        scores = np.concatenate([v.dot(probe) for v in vectors]) if vectors else np.empty(0, dtype=np.float32)
+        owners = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+        if self.rerank and len(scores):
+            self._rerank(scores, vectors, probe)
+        results: List[Tuple[int, float]] = []
+        seen: Set[int] = set()
+        for row in np.argsort(-scores):
+            owner = int(owners[row])
+            if owner in seen:
+                continue
+            seen.add(owner)
+            results.append((owner, float(scores[row])))
+            if len(results) == k:
+                break
+        return results
+
+    def _rerank(self, scores: np.ndarray, vectors: List[QuantizedMatrix], probe: np.ndarray) -> None:
+        """Rescore the best `rerank` candidates across the probed lists from dequantized rows with a float32 probe, in place."""
+        count = min(self.rerank, len(scores))
+        top = np.argpartition(-scores, count - 1)[:count]
+        starts = np.cumsum([0] + [len(v) for v in vectors])
+        part = np.searchsorted(starts, top, side="right") - 1
+        for list_no in np.unique(part):
+            rows = top[part == list_no]
+            scores[rows] = vectors[list_no].exact_dot(rows - starts[list_no], probe)
+
+    # --- persistence ----------------------------------------------------
+
+    def save(self, path: str) -> None:
+        """Write the index atomically (temp file + rename) so readers never see a partial file."""
+        with self._lock:
+            sizes = np.array([len(ids) for ids in self._list_ids], dtype=np.int64)
+            arrays = {
+                "dim": np.array(self.dim),
+                "centroids": self.centroids if self.centroids is not None else np.empty((0, self.dim), dtype=np.float32),
+                "ids": np.concatenate(self._list_ids),
+                "precision": np.array(self.precision),
+                "codes": np.concatenate([vectors.codes for vectors in self._list_vectors]),
+                "scales": np.concatenate([vectors.scales for vectors in self._list_vectors])
+                if self.precision == "int8"
+                else np.empty(0, dtype=np.float32),
+                "sizes": sizes,
+                "trained_size": np.array(self._trained_size),
+                "signature": np.array(self.signature or ""),
+            }
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as handle:
+            np.savez(handle, **arrays)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> bool:
+        """
+        Load a saved index; returns False if the file is missing or was built for another
+        dimension or precision (re-quantizing a lossy file would compound the error).
+        """
+        if not os.path.exists(path):
+            return False
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["dim"]) != self.dim or "codes" not in data or str(data["precision"]) != self.precision:
+                return False
+            centroids = data["centroids"]
+            ids, sizes = data["ids"], data["sizes"]
+            matrix = QuantizedMatrix(data["codes"], data["scales"] if self.precision == "int8" else None, self.precision)
+            bounds = np.concatenate([[0], np.cumsum(sizes)])
+            with self._lock:
+                self.centroids = centroids if len(centroids) else None
+                self._list_ids = [ids[bounds[i]:bounds[i + 1]] for i in range(len(sizes))]
+                self._list_vectors = [matrix.take(slice(bounds[i], bounds[i + 1])) for i in range(len(sizes))]
+                self._lists_by_owner = {}
+                for list_no, list_ids in enumerate(self._list_ids):
+                    for owner in np.unique(list_ids):
+                        self._lists_by_owner.setdefault(int(owner), set()).add(list_no)
+                self._trained_size = int(data["trained_size"])
+                self.signature = str(data["signature"]) or None
+        return True
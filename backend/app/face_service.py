@@ -1,13 +1,29 @@
 import base64
+import binascii
+import hashlib
 import json
 import os
-from functools import lru_cache
-from typing import Iterable, Optional, Tuple, List
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, Iterator, Optional, Sequence, Tuple, List, Union
 
 import cv2
 import numpy as np
 
-# We removed 'onnxruntime' to save RAM!
+from .config import get_settings
+from .face_index import FaceIndex
+from .gallery_store import SharedGalleryStore, gallery_store
+from .inference_backends import RecognitionBackend, create_recognition_backend
+from .metrics import recognition_batch_size, stage
+from .quantization import QuantizedMatrix, normalize_rows
+
+# YuNet always runs on cv2.dnn; SFace runs on settings.face_inference_backend (cv2.dnn by
+# default, or onnxruntime when installed), see inference_backends.py
+
+settings = get_settings()
 
 # Model Paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -16,18 +32,72 @@ YUNET_PATH = os.path.join(MODELS_DIR, "face_detection_yunet_2023mar.onnx")
 # Ensure this filename matches exactly what is in your models folder
 ARCFACE_PATH = os.path.join(MODELS_DIR, "face_recognition_sface_2021dec.onnx")
 
-def _decode_image(image_data: str) -> np.ndarray:
+# SFace produces 128-dim feature vectors
+EMBEDDING_DIM = 128
+# Stored next to every embedding blob so vectors from a future model are never mixed with these
+MODEL_VERSION = "sface_2021dec"
+
+# A base64 data URL (JSON clients) or the raw encoded image bytes (binary uploads)
+ImagePayload = Union[str, bytes, bytearray]
+
+_thread_state = threading.local()
+
+def _per_thread(factory: Callable):
+    """
+    Cache a model factory per thread instead of per process. OpenCV detector/recognizer
+    objects are not safe to share: detector.setInputSize and dnn nets mutate internal state.
+    """
+    @wraps(factory)
+    def getter():
+        instance = getattr(_thread_state, factory.__name__, None)
+        if instance is None:
+            instance = factory()
+            setattr(_thread_state, factory.__name__, instance)
+        return instance
+    return getter
+
+class ImageDecodeError(ValueError):
+    """The payload isn't an image at all (missing, bad base64, undecodable), as opposed to an image without a usable face."""
+
+
+def _payload_buffer(image_data: ImagePayload) -> np.ndarray:
+    """The encoded image bytes of a payload; raw uploads are wrapped without a copy."""
     if not image_data:
-        raise ValueError("Image payload missing")
-    if "," in image_data:
-        image_data = image_data.split(",", 1)[1]
-    buffer = np.frombuffer(base64.b64decode(image_data), dtype=np.uint8)
-    image = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+        raise ImageDecodeError("Image payload missing")
+    if isinstance(image_data, str):
+        if "," in image_data:
+            image_data = image_data.split(",", 1)[1]
+        try:
+            return np.frombuffer(base64.b64decode(image_data), dtype=np.uint8)
+        except (binascii.Error, ValueError) as exc:
+            raise ImageDecodeError("Image payload is not valid base64") from exc
+    return np.frombuffer(image_data, dtype=np.uint8)
+
+def _decode_buffer(buffer: np.ndarray, full_resolution: bool = False) -> np.ndarray:
+    # Client-supplied face coordinates refer to the full-resolution image
+    flags = cv2.IMREAD_COLOR if full_resolution else _decode_flags(len(buffer))
+    image = cv2.imdecode(buffer, flags)
     if image is None:
-        raise ValueError("Unable to decode image")
+        raise ImageDecodeError("Unable to decode image")
     return image
 
-@lru_cache
+def _decode_image(image_data: ImagePayload) -> np.ndarray:
+    return _decode_buffer(_payload_buffer(image_data))
+
+def _decode_flags(payload_size: int) -> int:
+    """
+    Large JPEGs are decoded at 1/2 or 1/4 scale straight from the DCT coefficients.
+    Even a quarter of a multi-megapixel frame leaves far more than the 112x112 that
+    alignment needs, and reduced decoding is much cheaper than a full decode.
+    """
+    threshold = settings.face_reduced_decode_bytes
+    if threshold <= 0 or payload_size <= threshold:
+        return cv2.IMREAD_COLOR
+    if payload_size > 4 * threshold:
+        return cv2.IMREAD_REDUCED_COLOR_4
+    return cv2.IMREAD_REDUCED_COLOR_2
+
+@_per_thread
 def _get_face_detector():
     if not os.path.exists(YUNET_PATH):
         raise RuntimeError(f"YuNet model not found at {YUNET_PATH}")
@@ -38,132 +108,748 @@ def _get_face_detector():
         input_size=(640, 640), 
         score_threshold=0.5, # Slightly lower threshold for detection
         nms_threshold=0.3,
-        top_k=5000,
+        top_k=settings.face_detect_top_k,
         backend_id=cv2.dnn.DNN_BACKEND_OPENCV,
         target_id=cv2.dnn.DNN_TARGET_CPU,
     )
     return detector
 
-@lru_cache
-def _get_face_recognizer():
+@_per_thread
+def _get_recognition_backend() -> RecognitionBackend:
+    """This thread's runtime for the SFace forward pass (settings.face_inference_backend)."""
     if not os.path.exists(ARCFACE_PATH):
         raise RuntimeError(f"SFace model not found at {ARCFACE_PATH}")
-    
-    # Use OpenCV's Native SFace Backend (Very Light RAM Usage)
-    recognizer = cv2.FaceRecognizerSF.create(
-        model=ARCFACE_PATH,
-        config="",
-        backend_id=cv2.dnn.DNN_BACKEND_OPENCV,
-        target_id=cv2.dnn.DNN_TARGET_CPU
-    )
-    return recognizer
+    return create_recognition_backend(settings.face_inference_backend, ARCFACE_PATH)
 
-def extract_embedding(image_data: str) -> str:
+def embed_aligned_faces(crops: Sequence[np.ndarray]) -> np.ndarray:
     """
-    Extract face embedding using YuNet (Detection) and SFace (Recognition).
+    Embed N align_face crops, in a single forward pass where the backend can batch.
+    Returns an (N, EMBEDDING_DIM) matrix of unit-length rows.
+    """
+    if len(crops) == 0:
+        return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+    features = _get_recognition_backend().embed(crops)
+    return normalize_rows(features.astype(np.float32))
+
+class _Batch:
+    def __init__(self):
+        self.crops: List[np.ndarray] = []
+        self.embeddings: Optional[np.ndarray] = None
+        self.error: Optional[BaseException] = None
+        self.done = threading.Event()
+
+
+class _BatchTicket:
+    def __init__(self, batcher: "RecognitionBatcher"):
+        self.batcher = batcher
+        self.used = False
+
+    def embed(self, crop: np.ndarray) -> np.ndarray:
+        self.used = True
+        return self.batcher._embed(crop)
+
+
+class RecognitionBatcher:
+    """
+    Cross-request micro-batching of SFace forward passes. Inference workers that reach the
+    recognition stage at about the same time share one embed_aligned_faces call.
+
+    The first crop to arrive leads a batch: it waits up to `max_wait_ms` for crops from
+    requests that are still in detection (announced via reserve()), stops early once
+    `max_batch` crops have joined or nobody else is coming, runs the batch on its own thread
+    and hands every caller its row. A request that is alone never waits.
+    """
+
+    def __init__(self, max_batch: int, max_wait_ms: float):
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._cond = threading.Condition()
+        self._open: Optional[_Batch] = None
+        self._upcoming = 0
+
+    @contextmanager
+    def reserve(self) -> Iterator[_BatchTicket]:
+        """Announce that this thread will submit a crop, so a forming batch can wait for it."""
+        ticket = _BatchTicket(self)
+        with self._cond:
+            self._upcoming += 1
+        try:
+            yield ticket
+        finally:
+            if not ticket.used:
+                # Rejected or failed before recognition: stop holding the batch open for us
+                with self._cond:
+                    self._upcoming -= 1
+                    self._cond.notify_all()
+
+    def _embed(self, crop: np.ndarray) -> np.ndarray:
+        with self._cond:
+            self._upcoming -= 1
+            batch = self._open
+            leader = batch is None or len(batch.crops) >= self.max_batch
+            if leader:
+                batch = self._open = _Batch()
+            index = len(batch.crops)
+            batch.crops.append(crop)
+            self._cond.notify_all()
+            if leader:
+                deadline = time.monotonic() + self.max_wait
+                while len(batch.crops) < self.max_batch and self._upcoming > 0:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._open is batch:
+                    self._open = None
+
+        if leader:
+            recognition_batch_size.observe(len(batch.crops))
+            try:
+                batch.embeddings = embed_aligned_faces(batch.crops)
+            except BaseException as exc:
+                batch.error = exc
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.embeddings[index]
+
+
+recognition_batcher = RecognitionBatcher(
+    max_batch=settings.face_batch_max_size,
+    max_wait_ms=settings.face_batch_max_wait_ms,
+)
+
+def warm_up() -> None:
+    """Load this thread's detector and recognizer so the first request doesn't pay for it."""
+    _get_face_detector()
+    _get_recognition_backend()
+
+def _detect_faces(image: np.ndarray, max_side: Optional[int] = None) -> np.ndarray:
+    """
+    Run YuNet on a copy of `image` capped to `max_side` pixels on its longest side, then map
+    boxes and landmarks back to `image` coordinates so alignment still works at full resolution.
+    Detection cost scales with pixel count; the cap loses nothing for faces that fill a webcam frame.
     """
-    image = _decode_image(image_data)
     h, w, _ = image.shape
-    
-    # 1. Detect Face
+    max_side = max_side or settings.face_detect_max_side
+    scale = min(1.0, max_side / max(h, w))
+    if scale < 1.0:
+        detect_image = cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    else:
+        detect_image = image
+    dh, dw, _ = detect_image.shape
+
     detector = _get_face_detector()
-    detector.setInputSize((w, h))
-    _, faces = detector.detect(image)
+    detector.setInputSize((dw, dh))
+    _, faces = detector.detect(detect_image)
     
     if faces is None or len(faces) == 0:
         raise ValueError("No face detected. Ensure good lighting and framing.")
-    
-    # Get the face with highest confidence (last column is score)
-    best_face = faces[np.argmax(faces[:, -1])]
-    
-    # 2. Recognition (Align & Extract in one step)
-    recognizer = _get_face_recognizer()
-    
-    # SFace has built-in alignment! No need for manual warpAffine.
-    aligned_face = recognizer.alignCrop(image, best_face)
-    
-    # Extract features (128-dim vector for SFace)
-    embedding = recognizer.feature(aligned_face)
-    
-    # 3. Flatten and return
-    embedding = embedding.flatten()
-    return json.dumps(embedding.tolist())
 
-def cosine_similarity(serialized_a: str, serialized_b: str) -> float:
-    vec_a = np.array(json.loads(serialized_a), dtype="float32")
-    vec_b = np.array(json.loads(serialized_b), dtype="float32")
-    
-    # SFace output is already normalized, but we double-check for safety
-    norm_a = np.linalg.norm(vec_a)
-    norm_b = np.linalg.norm(vec_b)
-    
-    if norm_a == 0 or norm_b == 0:
-        return 0.0
-        
-    return float(np.dot(vec_a, vec_b) / (norm_a * norm_b))
-
-# --- Helper Functions (No changes needed below here) ---
-
-def to_vector(serialized_embedding: str) -> str:
-    json.loads(serialized_embedding)
-    return serialized_embedding
-
-def serialize_embeddings(embeddings: list[str]) -> str:
-    return json.dumps(embeddings)
-
-def deserialize_embeddings(serialized: str) -> str:
-    try:
-        parsed = json.loads(serialized)
-        if isinstance(parsed, list):
-            if len(parsed) == 0:
-                raise ValueError("No embeddings found")
-            
-            if isinstance(parsed[0], str):
-                vectors = [np.array(json.loads(emb), dtype="float32") for emb in parsed]
-                if len(vectors) == 1:
-                    return parsed[0]
-                avg_vector = np.mean(vectors, axis=0)
-                norm = np.linalg.norm(avg_vector)
-                if norm > 0:
-                    avg_vector /= norm
-                return json.dumps(avg_vector.tolist())
-            
-            elif isinstance(parsed[0], list):
-                if len(parsed) == 1:
-                    return json.dumps(parsed[0])
-                vectors = [np.array(emb, dtype="float32") for emb in parsed]
-                avg_vector = np.mean(vectors, axis=0)
-                norm = np.linalg.norm(avg_vector)
-                if norm > 0:
-                    avg_vector /= norm
-                return json.dumps(avg_vector.tolist())
-            else:
-                return json.dumps(parsed[0])
-        else:
-            return serialized
-    except json.JSONDecodeError:
-        return serialized
-
-def best_match(
-    probe_vector: str, candidates: Iterable[Tuple[int, str]]
-) -> Tuple[Optional[int], float]:
-    best_id: Optional[int] = None
-    best_score = 0.0
-    
-    # DEBUG: Uncomment this to see scores in your terminal!
-    # print(f"\n--- Checking {len(list(candidates))} candidates ---")
+    if detect_image is not image:
+        # Columns 0-13 are x, y, w, h followed by five (x, y) landmarks; the last one is the score
+        faces = faces.copy()
+        faces[:, 0:14:2] *= w / dw
+        faces[:, 1:14:2] *= h / dh
+    return faces
+
+class FaceQualityError(ValueError):
+    """A detected face too poor to recognize; `reason` is one of QUALITY_REASONS."""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+QUALITY_REASONS = ("too_small", "off_angle", "blurry", "too_dark", "too_bright")
+
+_quality_rejects: Dict[str, int] = {reason: 0 for reason in QUALITY_REASONS}
+_quality_lock = threading.Lock()
+
+def assess_face_quality(image: np.ndarray, face: np.ndarray) -> Optional[FaceQualityError]:
+    """
+    Cheap checks on a YuNet row before alignment/feature run: box size, yaw estimated from
+    how far the nose sits off the eye midline, Laplacian-variance sharpness and mean
+    brightness of the face region. Returns the first failure, or None for a usable face.
+    """
+    x, y, w, h = (float(v) for v in face[:4])
+    if min(w, h) < settings.face_min_face_px:
+        return FaceQualityError("too_small", "Face is too small. Move closer to the camera.")
+
+    if _yaw_ratio(face) > settings.face_max_yaw_ratio:
+        return FaceQualityError("off_angle", "Face is turned away. Look straight at the camera.")
+
+    ih, iw = image.shape[:2]
+    x0, y0 = max(0, int(x)), max(0, int(y))
+    x1, y1 = min(iw, int(x + w)), min(ih, int(y + h))
+    if x1 <= x0 or y1 <= y0:
+        return FaceQualityError("too_small", "Face is too small. Move closer to the camera.")
+    return _assess_patch(image[y0:y1, x0:x1])
+
+def _yaw_ratio(face: np.ndarray) -> float:
+    """How far the nose sits off the eye midline: 0 = frontal, 1 = profile."""
+    right_eye_x, left_eye_x, nose_x = float(face[4]), float(face[6]), float(face[8])
+    to_right, to_left = abs(nose_x - right_eye_x), abs(left_eye_x - nose_x)
+    if to_right + to_left == 0:
+        return 1.0
+    return abs(to_right - to_left) / (to_right + to_left)
+
+def _patch_measures(region: np.ndarray) -> Tuple[float, float]:
+    """(sharpness, brightness) of a face region."""
+    # A fixed 64x64 grey patch makes sharpness comparable across face sizes and keeps this cheap
+    patch = cv2.resize(cv2.cvtColor(region, cv2.COLOR_BGR2GRAY), (64, 64), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(patch, cv2.CV_32F).var()), float(patch.mean())
+
+def _assess_patch(region: np.ndarray) -> Optional[FaceQualityError]:
+    sharpness, brightness = _patch_measures(region)
+    if sharpness < settings.face_min_sharpness:
+        return FaceQualityError("blurry", "Image is blurred. Hold the camera steady.")
+    if brightness < settings.face_min_brightness:
+        return FaceQualityError("too_dark", "Face is too dark. Improve the lighting.")
+    if brightness > settings.face_max_brightness:
+        return FaceQualityError("too_bright", "Face is overexposed. Reduce the lighting.")
+    return None
+
+def quality_stats() -> Dict[str, int]:
+    """Rejections per reason since startup."""
+    with _quality_lock:
+        return dict(_quality_rejects)
+
+ALIGNED_SIZE = 112
+# Where SFace expects the eyes, nose tip and mouth corners in its aligned input
+ALIGN_TEMPLATE = np.array(
+    [[38.2946, 51.6963], [73.5318, 51.5014], [56.0252, 71.7366], [41.5493, 92.3655], [70.7299, 92.2041]],
+    dtype=np.float32,
+)
+
+def align_face(image: np.ndarray, face: np.ndarray) -> np.ndarray:
+    """
+    The ALIGNED_SIZE crop SFace embeds, identical to cv2.FaceRecognizerSF.alignCrop: warp by the
+    least-squares similarity transform (Umeyama) taking the row's five landmarks onto
+    ALIGN_TEMPLATE. Doing it here means a thread loads SFace once, in its recognition backend,
+    instead of a second time in a FaceRecognizerSF kept only for alignment.
+    """
+    src = np.asarray(face[4:14], dtype=np.float64).reshape(5, 2)
+    dst = ALIGN_TEMPLATE.astype(np.float64)
+    src_mean, dst_mean = src.mean(axis=0), dst.mean(axis=0)
+    src_centered, dst_centered = src - src_mean, dst - dst_mean
+    src_var = (src_centered ** 2).sum() / len(src)
+    if src_var <= 0:
+        raise ValueError("Face landmarks are degenerate")
+    u, singular, vt = np.linalg.svd(dst_centered.T @ src_centered / len(src))
+    # Rotation only: flip the last axis when the best orthogonal fit would be a reflection
+    d = np.array([1.0, np.sign(np.linalg.det(u) * np.linalg.det(vt)) or 1.0])
+    rotation = u @ np.diag(d) @ vt
+    scale = (singular * d).sum() / src_var
+    matrix = np.hstack([scale * rotation, (dst_mean - scale * rotation @ src_mean)[:, None]])
+    return cv2.warpAffine(image, matrix, (ALIGNED_SIZE, ALIGNED_SIZE), flags=cv2.INTER_LINEAR)
+
+def _supplied_face(image: np.ndarray, hint: Sequence[float]) -> np.ndarray:
+    """
+    Sanity-check a client-side detection (x, y, w, h and five landmarks, optionally a score)
+    and return it as a YuNet-style row. Landmarks must fall inside the (slightly padded) box
+    and the box must overlap the image, which is all align_face needs to behave.
+    """
+    row = np.asarray(hint, dtype=np.float32).ravel()
+    if row.size not in (14, 15) or not np.all(np.isfinite(row)):
+        raise ValueError("Face hint must be x, y, w, h followed by five landmark (x, y) pairs")
+    x, y, w, h = (float(v) for v in row[:4])
+    ih, iw = image.shape[:2]
+    if w <= 0 or h <= 0 or x >= iw or y >= ih or x + w <= 0 or y + h <= 0:
+        raise ValueError("Face hint box lies outside the image")
+    landmarks = row[4:14].reshape(5, 2)
+    pad_x, pad_y = 0.25 * w, 0.25 * h
+    inside = (
+        (landmarks[:, 0] >= x - pad_x) & (landmarks[:, 0] <= x + w + pad_x)
+        & (landmarks[:, 1] >= y - pad_y) & (landmarks[:, 1] <= y + h + pad_y)
+    )
+    if not inside.all():
+        raise ValueError("Face hint landmarks lie outside the face box")
+    return np.append(row[:14], 1.0).astype(np.float32)
+
+def _reject_if_poor(rejection: Optional[FaceQualityError]) -> None:
+    if rejection is not None:
+        with _quality_lock:
+            _quality_rejects[rejection.reason] += 1
+        raise rejection
+
+def _align_best_face(
+    buffer: np.ndarray, hint: Optional[Sequence[float]] = None, aligned: bool = False
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (detector row, 112x112 aligned crop) for the face in `buffer`. A client-supplied `hint`
+    replaces YuNet; an `aligned` payload is already the crop and skips alignment as well.
+    """
+    with stage("decode"):
+        image = _decode_buffer(buffer, full_resolution=hint is not None or aligned)
+
+    if aligned:
+        if image.shape[:2] != (ALIGNED_SIZE, ALIGNED_SIZE):
+            raise ValueError(f"Aligned crops must be {ALIGNED_SIZE}x{ALIGNED_SIZE} pixels")
+        if settings.face_quality_gate:
+            with stage("quality"):
+                rejection = _assess_patch(image)
+            _reject_if_poor(rejection)
+        face = np.zeros(15, dtype=np.float32)
+        face[2:4] = ALIGNED_SIZE
+        face[14] = 1.0
+        return face, image
+
+    if hint is not None:
+        best_face = _supplied_face(image, hint)
+    else:
+        # 1. Detect Face
+        with stage("detect"):
+            faces = _detect_faces(image)
+
+        # Get the face with highest confidence (last column is score)
+        best_face = faces[np.argmax(faces[:, -1])]
+
+    # Reject hopeless frames before paying for alignment and the CNN
+    if settings.face_quality_gate:
+        with stage("quality"):
+            rejection = assess_face_quality(image, best_face)
+        _reject_if_poor(rejection)
     
-    for candidate_id, candidate_vector in candidates:
-        score = cosine_similarity(probe_vector, candidate_vector)
-        
-        # DEBUG: See what scores you are getting
-        # print(f"ID {candidate_id}: Score {score:.4f}")
-        
-        if score > best_score:
-            best_id = candidate_id
-            best_score = score
-            
-    return best_id, best_score
+    # 2. Alignment to SFace's landmark template
+    with stage("align"):
+        return best_face, align_face(image, best_face)
+
+def _probe_key(buffer: np.ndarray, hint: Optional[Sequence[float]], aligned: bool) -> bytes:
+    if hint is None and not aligned:
+        return probe_cache.key(buffer)
+    salt = np.asarray(hint if hint is not None else [], dtype=np.float32).tobytes() + bytes([aligned])
+    return probe_cache.key(buffer, salt)
+
+def extract_embedding(
+    image_data: ImagePayload, face: Optional[Sequence[float]] = None, aligned: bool = False
+) -> np.ndarray:
+    """
+    Extract face embedding using YuNet (Detection) and SFace (Recognition).
+    `face` / `aligned` let a client that already detected (or cropped) the face skip those stages.
+    Returns a unit-length float32 vector; resubmits of the same image come from probe_cache.
+    """
+    buffer = _payload_buffer(image_data)
+    key = _probe_key(buffer, face, aligned)
+    cached = probe_cache.get(key)
+    if cached is not None:
+        return cached[1]
+
+    with recognition_batcher.reserve() as ticket:
+        best_face, aligned_face = _align_best_face(buffer, face, aligned)
+
+        # 3. Extract features (128-dim vector for SFace), batched with concurrent requests
+        with stage("feature"):
+            embedding = ticket.embed(aligned_face).copy()
+
+    probe_cache.put(key, best_face, embedding)
+    return embedding
+
+def sample_quality(face: np.ndarray, crop: np.ndarray) -> float:
+    """
+    Score in [0, 1] for ranking enrollment frames that already passed the quality gate:
+    detector confidence x frontalness x sharpness x exposure x face size, each capped so a
+    frame comfortably above the gate's minimums scores near 1 on that factor.
+    """
+    sharpness, brightness = _patch_measures(crop)
+    confidence = float(np.clip(face[14], 0.0, 1.0))
+    # Pre-aligned crops come without landmarks; alignment already made them frontal
+    frontal = 1.0 - _yaw_ratio(face) if face[4:14].any() else 1.0
+    # A threshold of 0 disables that gate, and with it that factor of the score
+    sharp = min(1.0, sharpness / (4 * settings.face_min_sharpness)) if settings.face_min_sharpness > 0 else 1.0
+    exposure = max(0.0, 1.0 - abs(brightness - 128.0) / 128.0)
+    size = min(1.0, float(min(face[2], face[3])) / (2 * settings.face_min_face_px)) if settings.face_min_face_px > 0 else 1.0
+    return confidence * frontal * sharp * exposure * size
+
+def prepare_enrollment_sample(
+    image_data: ImagePayload, face: Optional[Sequence[float]] = None, aligned: bool = False
+) -> Tuple[float, np.ndarray]:
+    """
+    Detect, gate and align one enrollment frame without running SFace, so a burst of frames
+    can be ranked first and only the best few embedded. Returns (sample_quality, aligned crop).
+    """
+    best_face, crop = _align_best_face(_payload_buffer(image_data), face, aligned)
+    with stage("quality"):
+        return sample_quality(best_face, crop), crop
+
+def extract_all_embeddings(image_data: ImagePayload) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Align and embed every face YuNet finds in a frame (e.g. a classroom photo).
+    Returns (faces, embeddings): the raw detector rows and one unit-length row per face.
+    """
+    # Decoded at full resolution: the returned boxes are in the photo's own coordinates,
+    # alignment uses every pixel, and only detection sees the face_classroom_detect_max_side copy
+    with stage("decode"):
+        image = _decode_buffer(_payload_buffer(image_data), full_resolution=True)
+    # Classroom photos have small faces in the back rows, so they get a larger detection cap
+    with stage("detect"):
+        faces = _detect_faces(image, settings.face_classroom_detect_max_side)
+    with stage("align"):
+        crops = [align_face(image, face) for face in faces]
+    with stage("feature"):
+        return faces, embed_aligned_faces(crops)
 
 def get_model_info() -> str:
-    return "SFace (MobileNetV2) + YuNet"
\ No newline at end of file
+    return f"SFace (MobileNetV2) + YuNet on {settings.face_inference_backend}"
+
+
+# --- Binary embedding storage ---
+# Embeddings are stored as a BLOB of little-endian float32 samples (sample_count x EMBEDDING_DIM),
+# each sample normalized to unit length at write time.
+
+def pack_embeddings(vectors: Sequence[np.ndarray]) -> bytes:
+    if len(vectors) == 0:
+        raise ValueError("No embeddings found")
+    matrix = np.vstack([np.asarray(vector, dtype=np.float32).reshape(-1, EMBEDDING_DIM) for vector in vectors])
+    return normalize_rows(matrix).astype("<f4").tobytes()
+
+
+def unpack_embeddings(blob: bytes) -> np.ndarray:
+    """Zero-copy view of a stored blob as a (samples, EMBEDDING_DIM) float32 matrix."""
+    if not blob or len(blob) % (EMBEDDING_DIM * 4):
+        raise ValueError("Malformed embedding blob")
+    return np.frombuffer(blob, dtype="<f4").reshape(-1, EMBEDDING_DIM)
+
+
+def parse_legacy_embeddings(serialized: str) -> np.ndarray:
+    """
+    Parse the old JSON layouts (a single list of floats, a list of lists, or a list of
+    JSON strings) into a (samples, EMBEDDING_DIM) matrix. Only used by migrate_db.py.
+    """
+    parsed = json.loads(serialized)
+    if not isinstance(parsed, list) or len(parsed) == 0:
+        raise ValueError("No embeddings found")
+    if isinstance(parsed[0], str):
+        samples = [json.loads(item) for item in parsed]
+    elif isinstance(parsed[0], list):
+        samples = parsed
+    else:
+        samples = [parsed]
+    return np.asarray(samples, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+
+
+def embedding_templates(blob: bytes, limit: Optional[int] = None) -> np.ndarray:
+    """
+    A stored embedding blob as unit-length float32 template rows, at most `limit` of them.
+    Used once when a gallery is built, never per request.
+    """
+    templates = unpack_embeddings(blob)
+    if limit:
+        templates = templates[:limit]
+    return normalize_rows(templates).astype(np.float32)
+
+
+class FaceGallery:
+    """
+    Every enrollment template of every student as rows of one contiguous, pre-normalized
+    matrix, grouped by student. A probe is scored against all templates with a single
+    matrix-vector product, then reduced per student: the best template (top_k=1) or the
+    mean of the best `top_k`, so an off-angle capture can still match the closest pose.
+    Templates may be held as float16 or int8 (see QuantizedMatrix) to shrink the gallery;
+    the best `rerank` template scores per probe are then rescored from dequantized rows with
+    a float32 probe, which removes the probe's rounding but not the stored rows' own.
+    """
+
+    def __init__(
+        self,
+        student_ids: Sequence[int],
+        templates: Sequence[np.ndarray],
+        top_k: int = 1,
+        precision: str = "float32",
+        rerank: int = 0,
+    ):
+        blocks = [np.asarray(t, dtype=np.float32).reshape(-1, EMBEDDING_DIM) for t in templates]
+        counts = np.array([len(block) for block in blocks], dtype=np.int64)
+        if blocks:
+            matrix = np.vstack(blocks)
+        else:
+            matrix = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        self._setup(student_ids, counts, QuantizedMatrix.encode(normalize_rows(matrix), precision), top_k, rerank)
+
+    @classmethod
+    def from_matrix(
+        cls, student_ids: np.ndarray, counts: np.ndarray, matrix: QuantizedMatrix, top_k: int = 1, rerank: int = 0
+    ) -> "FaceGallery":
+        """A gallery over rows that are already normalized and grouped, e.g. a mapped gallery file; nothing is copied."""
+        gallery = cls.__new__(cls)
+        gallery._setup(student_ids, counts, matrix, top_k, rerank)
+        return gallery
+
+    def _setup(self, student_ids: Sequence[int], counts: np.ndarray, matrix: QuantizedMatrix, top_k: int, rerank: int) -> None:
+        self.student_ids = np.asarray(student_ids, dtype=np.int64)
+        self.matrix = matrix
+        self.rerank = rerank if matrix.precision != "float32" else 0
+        # Row r of the matrix belongs to student self.owners[r]; rows of one student are contiguous
+        self.owners = np.repeat(np.arange(len(counts)), counts)
+        self._counts = counts
+        self._offsets = (np.cumsum(counts) - counts).astype(np.int64)
+        self._slots = np.arange(len(self.matrix)) - np.repeat(self._offsets, counts)
+        self._max_templates = int(counts.max()) if len(counts) else 0
+        self.top_k = max(1, top_k)
+        self._index_by_student = {int(sid): index for index, sid in enumerate(self.student_ids)}
+
+    def __len__(self) -> int:
+        return len(self.student_ids)
+
+    def _reduce(self, template_scores: np.ndarray) -> np.ndarray:
+        """Segment-reduce (..., templates) scores to (..., students)."""
+        if self.top_k == 1 or self._max_templates == 1:
+            return np.maximum.reduceat(template_scores, self._offsets, axis=-1)
+        padded = np.full(template_scores.shape[:-1] + (len(self), self._max_templates), -np.inf, dtype=np.float32)
+        padded[..., self.owners, self._slots] = template_scores
+        k = min(self.top_k, self._max_templates)
+        best = -np.partition(-padded, k - 1, axis=-1)[..., :k]
+        # Students with fewer than k templates average the ones they have
+        present = np.isfinite(best)
+        return np.where(present, best, 0).sum(axis=-1) / present.sum(axis=-1)
+
+    def _template_scores(self, probes: np.ndarray) -> np.ndarray:
+        """Probe x template scores at the stored precision, the best `rerank` per probe rescored from dequantized rows with a float32 probe."""
+        scores = self.matrix.dot(probes)
+        if self.rerank and len(self.matrix):
+            k = min(self.rerank, len(self.matrix))
+            # atleast_2d returns views, so the single-probe case is updated in place too
+            for row_scores, probe in zip(np.atleast_2d(scores), np.atleast_2d(probes)):
+                top = np.argpartition(-row_scores, k - 1)[:k]
+                row_scores[top] = self.matrix.exact_dot(top, probe)
+        return scores
+
+    def scores(self, probe: np.ndarray) -> np.ndarray:
+        probe = np.asarray(probe, dtype=np.float32).ravel()
+        norm = np.linalg.norm(probe)
+        if norm == 0 or len(self) == 0:
+            return np.zeros(len(self), dtype=np.float32)
+        return self._reduce(self._template_scores(probe / norm))
+
+    def match(self, probe: np.ndarray) -> Tuple[Optional[int], float]:
+        """(student_id, score) of the best-scoring student, or (None, 0.0) when nothing scores above zero."""
+        if len(self) == 0:
+            return None, 0.0
+        scores = self.scores(probe)
+        index = int(np.argmax(scores))
+        score = float(scores[index])
+        if score <= 0:
+            return None, 0.0
+        return int(self.student_ids[index]), score
+
+    def assign(self, probes: np.ndarray, threshold: float) -> List[Tuple[int, int, float]]:
+        """
+        One-to-one assignment of probe rows to students from a single probes x templates product.
+        Pairs are taken greedily by descending score, so two faces can never claim the same student.
+        Returns (probe_index, student_id, score) for every pair scoring at least `threshold`.
+        """
+        if len(self) == 0 or len(probes) == 0:
+            return []
+        probes = normalize_rows(np.asarray(probes, dtype=np.float32).reshape(-1, EMBEDDING_DIM))
+        scores = self._reduce(self._template_scores(probes))
+        assignments: List[Tuple[int, int, float]] = []
+        used_probes: set[int] = set()
+        used_students: set[int] = set()
+        for flat in np.argsort(scores, axis=None)[::-1]:
+            probe_index, index = divmod(int(flat), scores.shape[1])
+            score = float(scores[probe_index, index])
+            if score < threshold:
+                break
+            if probe_index in used_probes or index in used_students:
+                continue
+            used_probes.add(probe_index)
+            used_students.add(index)
+            assignments.append((probe_index, int(self.student_ids[index]), score))
+            if len(used_probes) == len(probes) or len(used_students) == len(self):
+                break
+        return assignments
+
+    def vector_for(self, student_id: int, probe: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        """The student's template closest to `probe` (their first template without one)."""
+        index = self._index_by_student.get(student_id)
+        if index is None:
+            return None
+        start = self._offsets[index]
+        rows = self.matrix.decode(slice(start, start + self._counts[index]))
+        if probe is None:
+            return rows[0]
+        return rows[int(np.argmax(rows @ np.asarray(probe, dtype=np.float32).ravel()))]
+
+
+class GalleryCache:
+    """
+    Process-wide cache of FaceGallery objects keyed by course offering id.
+    Entries expire after `ttl_seconds` so that other worker processes eventually
+    see writes they were not told about; writers in this process invalidate eagerly.
+
+    With a SharedGalleryStore the galleries live in memory-mapped files instead: a miss
+    maps the file another worker published, or builds and publishes it, and the store's
+    generation counter carries invalidations to every process at once.
+    """
+
+    def __init__(self, ttl_seconds: float, store: Optional[SharedGalleryStore] = None):
+        self.ttl_seconds = ttl_seconds
+        self.store = store
+        self._entries: Dict[int, Tuple[float, FaceGallery]] = {}
+        # Shared mode: offering id -> (store generation, checked at, file identity, gallery)
+        self._shared: Dict[int, Tuple[int, float, Tuple[int, int], FaceGallery]] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key: int, builder: Callable[[], FaceGallery]) -> FaceGallery:
+        if self.store is not None:
+            return self._get_shared(key, builder)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[0] < self.ttl_seconds:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        gallery = builder()
+
+        with self._lock:
+            # Don't cache a gallery that was built while an invalidation happened
+            if generation == self._generation:
+                self._entries[key] = (now, gallery)
+        return gallery
+
+    def _get_shared(self, key: int, builder: Callable[[], FaceGallery]) -> FaceGallery:
+        generation = self.store.generation()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._shared.get(key)
+            # Recheck the file after ttl_seconds even without an invalidation, like the local entries
+            if entry and entry[0] == generation and now - entry[1] < self.ttl_seconds:
+                self.hits += 1
+                return entry[3]
+
+        shared = self.store.load(key, self.ttl_seconds)
+        if shared is None:
+            with self.store.build_lock(key):
+                # Another worker may have published it while we waited for the lock
+                shared = self.store.load(key, self.ttl_seconds)
+                if shared is None:
+                    with self._lock:
+                        self.misses += 1
+                    gallery = builder()
+                    if not self.store.publish(key, generation, gallery.student_ids, gallery._counts, gallery.matrix):
+                        return gallery  # built while an invalidation happened; use it once, don't share it
+                    shared = self.store.load(key, self.ttl_seconds)
+                    if shared is None:
+                        return gallery
+                else:
+                    with self._lock:
+                        self.hits += 1
+        else:
+            with self._lock:
+                self.hits += 1
+
+        identity, student_ids, counts, matrix = shared
+        with self._lock:
+            entry = self._shared.get(key)
+            if entry and entry[2] == identity:
+                gallery = entry[3]  # same file as before; keep the existing views
+            else:
+                gallery = FaceGallery.from_matrix(
+                    student_ids, counts, matrix, top_k=settings.face_template_top_k, rerank=settings.face_vector_rerank
+                )
+            self._shared[key] = (generation, now, identity, gallery)
+        return gallery
+
+    @property
+    def generation(self) -> int:
+        """Bumped on every invalidation; long-lived holders of a gallery compare it to notice changes."""
+        if self.store is not None:
+            return self.store.generation()
+        return self._generation
+
+    def invalidate(self, key: Optional[int] = None) -> None:
+        if self.store is not None:
+            self.store.invalidate(key)
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._entries.clear()
+                self._shared.clear()
+            else:
+                self._entries.pop(key, None)
+                self._shared.pop(key, None)
+
+
+class ProbeCache:
+    """
+    Bounded LRU of recent single-face results keyed by a hash of the encoded image bytes,
+    so a retried upload of the same JPEG skips decode, detection and the CNN entirely.
+    The base64 layer is stripped before hashing: JSON and binary uploads share entries.
+    Values are (detector row, embedding) and are handed out read-only.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[bytes, Tuple[float, np.ndarray, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(buffer: np.ndarray, salt: bytes = b"") -> bytes:
+        digest = hashlib.blake2b(buffer, digest_size=16)
+        if salt:
+            digest.update(salt)
+        return digest.digest()
+
+    def get(self, key: bytes) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        if self.max_entries <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry[0] >= self.ttl_seconds:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, key: bytes, face: np.ndarray, embedding: np.ndarray) -> None:
+        if self.max_entries <= 0:
+            return
+        face.setflags(write=False)
+        embedding.setflags(write=False)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), face, embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+gallery_cache = GalleryCache(ttl_seconds=settings.face_gallery_ttl_seconds, store=gallery_store)
+
+probe_cache = ProbeCache(
+    max_entries=settings.face_probe_cache_size,
+    ttl_seconds=settings.face_probe_cache_ttl_seconds,
+)
+
+# Institution-wide index for walk-in identification; populated by crud.get_institution_index
+institution_index = FaceIndex(
+    EMBEDDING_DIM,
+    nlist=settings.face_index_nlist,
+    nprobe=settings.face_index_nprobe,
+    exact_below=settings.face_index_exact_below,
+    precision=settings.face_vector_precision,
+    rerank=settings.face_vector_rerank,
+)
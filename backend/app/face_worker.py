@@ -0,0 +1,345 @@
+"""
+Out-of-process face recognition (settings.face_inference_mode = "worker").
+
+    python -m app.face_worker                      # settings.face_worker_processes processes
+    python -m app.face_worker --processes 4 --socket /run/attendance/face.sock
+
+The worker listens on a Unix socket and runs the face_service entry points in JOBS on its
+own InferencePool; the API's RemoteInferencePool sends it jobs. With several processes they
+all accept on the one listening socket, so the kernel spreads connections across them.
+
+Wire format, both directions: a 4-byte big-endian header length, a JSON header, then the
+binary buffers the header lists in "sizes". Upload bytes and numpy arrays travel as raw
+buffers (no base64, no image re-encoding); arrays carry dtype and shape in the header.
+
+Metrics: the worker serves no /metrics of its own. Every reply carries the histogram
+observations the job made (stage timings, recognition batch sizes), which the API records
+as if it had made them, and the worker process's running totals for quality rejects and
+the probe cache, which the API sums over worker processes (worker_totals). The API's
+/metrics therefore covers both modes.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import threading
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from .config import get_settings
+from .inference import InferenceBusyError, InferencePool, InferenceUnavailableError
+from .metrics import capture_observations, registry
+
+settings = get_settings()
+
+# face_service functions a client may call, by name
+JOBS = ("warm_up", "extract_embedding", "extract_all_embeddings", "prepare_enrollment_sample", "embed_aligned_faces")
+
+HEADER_LENGTH = struct.Struct("!I")
+MAX_HEADER_BYTES = 1024 * 1024
+
+
+class ConnectionClosed(ConnectionError):
+    pass
+
+
+def _encode(value: Any, buffers: List[Any]) -> Any:
+    """JSON-safe form of `value`, moving arrays and bytes to `buffers`."""
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        buffers.append(value)
+        return {"array": len(buffers) - 1, "dtype": value.dtype.str, "shape": list(value.shape)}
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        buffers.append(value)
+        return {"bytes": len(buffers) - 1}
+    if isinstance(value, tuple):
+        return {"tuple": [_encode(item, buffers) for item in value]}
+    if isinstance(value, list):
+        return [_encode(item, buffers) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _decode(value: Any, buffers: Sequence[bytearray]) -> Any:
+    # Dicts only ever appear as the markers _encode writes
+    if isinstance(value, dict):
+        if "array" in value:
+            return np.frombuffer(buffers[value["array"]], dtype=value["dtype"]).reshape(value["shape"])
+        if "bytes" in value:
+            return buffers[value["bytes"]]
+        return tuple(_decode(item, buffers) for item in value["tuple"])
+    if isinstance(value, list):
+        return [_decode(item, buffers) for item in value]
+    return value
+
+
+def _recv_into(sock: socket.socket, buffer: bytearray) -> None:
+    view = memoryview(buffer)
+    while view:
+        received = sock.recv_into(view)
+        if not received:
+            raise ConnectionClosed("Face worker connection closed")
+        view = view[received:]
+
+
+def send_message(sock: socket.socket, header: dict, value: Any) -> None:
+    buffers: List[Any] = []
+    header = dict(header, value=_encode(value, buffers))
+    header["sizes"] = [memoryview(buffer).nbytes for buffer in buffers]
+    encoded = json.dumps(header).encode()
+    sock.sendall(HEADER_LENGTH.pack(len(encoded)) + encoded)
+    for buffer in buffers:
+        if memoryview(buffer).nbytes:  # an empty array's view can't be cast to bytes
+            sock.sendall(memoryview(buffer).cast("B"))
+
+
+def recv_message(sock: socket.socket) -> Tuple[dict, Any]:
+    prefix = bytearray(HEADER_LENGTH.size)
+    _recv_into(sock, prefix)
+    (length,) = HEADER_LENGTH.unpack(prefix)
+    if length > MAX_HEADER_BYTES:
+        raise ConnectionError("Face worker message header too large")
+    encoded = bytearray(length)
+    _recv_into(sock, encoded)
+    header = json.loads(encoded)
+    # One bytearray per buffer, filled in place, so arrays and frames are never copied again
+    buffers = []
+    for size in header.pop("sizes"):
+        buffer = bytearray(size)
+        _recv_into(sock, buffer)
+        buffers.append(buffer)
+    return header, _decode(header.pop("value"), buffers)
+
+
+def _error_reply(exc: Exception) -> dict:
+    from .face_service import FaceQualityError, ImageDecodeError
+
+    if isinstance(exc, FaceQualityError):
+        return {"error": "quality", "reason": exc.reason, "message": str(exc)}
+    if isinstance(exc, ImageDecodeError):
+        return {"error": "decode", "message": str(exc)}
+    if isinstance(exc, InferenceBusyError):
+        return {"error": "busy", "message": str(exc)}
+    if isinstance(exc, ValueError):
+        return {"error": "value", "message": str(exc)}
+    return {"error": "runtime", "message": str(exc)}
+
+
+def _raise_error(reply: dict) -> None:
+    from .face_service import FaceQualityError, ImageDecodeError
+
+    kind, message = reply["error"], reply["message"]
+    if kind == "quality":
+        raise FaceQualityError(reply["reason"], message)
+    if kind == "decode":
+        raise ImageDecodeError(message)
+    if kind == "busy":
+        raise InferenceBusyError(message)
+    if kind == "value":
+        raise ValueError(message)
+    raise RuntimeError(message)
+
+
+def _process_totals() -> dict:
+    from . import face_service
+
+    return {
+        "pid": os.getpid(),
+        "quality_rejects": face_service.quality_stats(),
+        "probe_hits": face_service.probe_cache.hits,
+        "probe_misses": face_service.probe_cache.misses,
+    }
+
+
+# API side: the latest totals reported by each worker process, by pid. A restarted worker
+# reports under a new pid and the old one's last totals stay, so the sums never go down.
+_worker_totals: Dict[int, dict] = {}
+_worker_totals_lock = threading.Lock()
+
+
+def _record_worker_metrics(reply: dict) -> None:
+    registry.replay(reply.pop("observations", ()))
+    totals = reply.pop("totals", None)
+    if totals is not None:
+        with _worker_totals_lock:
+            _worker_totals[totals["pid"]] = totals
+
+
+def worker_totals() -> dict:
+    """Quality rejects by reason and probe cache hits/misses, summed over every worker process seen."""
+    with _worker_totals_lock:
+        reports = list(_worker_totals.values())
+    quality: Dict[str, int] = {}
+    for report in reports:
+        for reason, count in report["quality_rejects"].items():
+            quality[reason] = quality.get(reason, 0) + count
+    return {
+        "quality_rejects": quality,
+        "probe_hits": sum(report["probe_hits"] for report in reports),
+        "probe_misses": sum(report["probe_misses"] for report in reports),
+    }
+
+
+def _run_job(fn, args: Sequence[Any]):
+    # Runs on the worker's pool thread, where the job's stages are timed
+    with capture_observations() as observations:
+        try:
+            return fn(*args), None, observations
+        except Exception as exc:
+            return None, exc, observations
+
+
+class FaceWorkerClient:
+    """One connection to the face worker; not thread-safe, so RemoteInferencePool keeps one per thread."""
+
+    def __init__(self, socket_path: str, timeout: float):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.sock = None
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def close(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def call(self, name: str, args: Sequence[Any]) -> Any:
+        if name not in JOBS:
+            raise ValueError(f"{name} can't run in the face worker")
+        # A kept-alive connection may have been closed by a restarted worker; jobs are
+        # side-effect free, so that case gets one retry on a fresh connection
+        for attempt in range(2):
+            reused = self.sock is not None
+            try:
+                if self.sock is None:
+                    self.sock = self._connect()
+                send_message(self.sock, {"job": name}, tuple(args))
+                reply, value = recv_message(self.sock)
+                break
+            except socket.timeout as exc:
+                self.close()
+                raise InferenceUnavailableError("Face worker timed out") from exc
+            except OSError as exc:
+                self.close()
+                if not reused or attempt:
+                    raise InferenceUnavailableError(f"Face worker unavailable at {self.socket_path}") from exc
+        _record_worker_metrics(reply)
+        if "error" in reply:
+            _raise_error(reply)
+        return value
+
+
+class FaceWorkerHandler(socketserver.BaseRequestHandler):
+    """Serves one client connection, one job at a time, until the client disconnects."""
+
+    server: "FaceWorkerServer"
+
+    def handle(self) -> None:
+        from . import face_service
+
+        while True:
+            try:
+                header, args = recv_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            observations = []
+            try:
+                if header.get("job") not in JOBS:
+                    raise ValueError(f"Unknown face worker job {header.get('job')!r}")
+                fn = getattr(face_service, header["job"])
+                value, error, observations = self.server.pool.submit(_run_job, fn, args).result()
+                if error is not None:
+                    raise error
+                reply = {}
+            except Exception as exc:
+                reply, value = _error_reply(exc), None
+            reply.update(observations=observations, totals=_process_totals())
+            try:
+                send_message(self.request, reply, value)
+            except OSError:
+                return
+
+
+class FaceWorkerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)  # left behind by a worker that didn't shut down cleanly
+        super().__init__(socket_path, FaceWorkerHandler)
+        os.chmod(socket_path, 0o600)  # frames are biometric data; only the API's user may connect
+        self.pool = None
+
+    def start_pool(self, processes: int) -> None:
+        # Each process gets its own pool, so OpenCV threads are split across all of them
+        workers = max(1, settings.face_inference_workers)
+        self.pool = InferencePool(
+            workers=workers,
+            queue_depth=settings.face_inference_queue_depth,
+            opencv_threads=settings.face_opencv_threads or max(1, (os.cpu_count() or 1) // (workers * processes)),
+        )
+        for job in self.pool.warm_up():
+            try:
+                job.result()
+            except Exception as exc:
+                print(f"[face-worker {os.getpid()}] models not loaded: {exc}", file=sys.stderr)
+
+
+def _serve(server: FaceWorkerServer, processes: int) -> None:
+    server.start_pool(processes)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.pool.shutdown()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Run face recognition out of process for the API")
+    parser.add_argument("--socket", default=settings.face_worker_socket, help="Unix socket path to listen on")
+    parser.add_argument("--processes", type=int, default=settings.face_worker_processes)
+    args = parser.parse_args(argv)
+    processes = max(1, args.processes)
+
+    server = FaceWorkerServer(args.socket)
+    print(f"Face worker listening on {args.socket} with {processes} process(es)")
+    try:
+        if processes == 1:
+            signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+            _serve(server, processes)
+            return
+        # Fork before any pool thread exists; children share the listening socket
+        context = multiprocessing.get_context("fork")
+        children = [context.Process(target=_serve, args=(server, processes), daemon=True) for _ in range(processes)]
+        for child in children:
+            child.start()
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        for child in children:
+            child.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
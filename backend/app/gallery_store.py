@@ -0,0 +1,234 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Iterator, Optional, Tuple
+
+from .config import get_settings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+if TYPE_CHECKING:
+    import numpy as np
+
+    from .quantization import QuantizedMatrix
+
+settings = get_settings()
+
+MAGIC = b"FGAL"
+FORMAT_VERSION = 1
+# magic, format version, generation, precision, dim, students, rows; padded to HEADER_SIZE
+HEADER = struct.Struct("<4sIQ8sIQQ")
+HEADER_SIZE = 64
+ALIGNMENT = 64  # every array starts on a cache line
+COUNTER = struct.Struct("<Q")
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+class SharedGalleryStore:
+    """
+    Offering galleries as memory-mapped files shared by every worker process on the host,
+    so each one is built once and held in the page cache once, however many workers run.
+
+    root/generation holds a counter that writers bump when face data changes; readers map it
+    and compare it on every lookup, which costs one memory read. A gallery file
+    (root/offering_<id>.gal) is a fixed header, carrying the generation it was built at,
+    followed by the student ids, template counts, int8 scales and the template codes, each
+    64-byte aligned so NumPy views them straight from the mapping. A file is published by
+    writing a temporary file and renaming it over the old one, and only if no invalidation
+    happened while it was being built; processes still mapping the old file keep a valid,
+    unchanged copy until they let go of it.
+
+    Files are never appended to. A face change invalidates the offering's file (or every
+    file), and the next reader rebuilds it from the database and writes it whole, once for all
+    workers. Appending to a published generation would save that rebuild on enrollment, but
+    templates are grouped by student and replacements happen as often as additions, so every
+    change would need a rewrite or a tombstone scheme; at a few thousand templates per
+    offering, the full rebuild is cheap.
+    """
+
+    def __init__(self, root: str, precision: str):
+        self.root = root
+        self.precision = precision
+        self._counter: Optional[mmap.mmap] = None
+        self._lock = threading.Lock()
+
+    def path(self, offering_id: int) -> str:
+        return os.path.join(self.root, f"offering_{offering_id}.gal")
+
+    def _counter_map(self) -> mmap.mmap:
+        # Opened on first use, so importing the module touches no files
+        with self._lock:
+            if self._counter is None:
+                os.makedirs(self.root, exist_ok=True)
+                fd = os.open(os.path.join(self.root, "generation"), os.O_RDWR | os.O_CREAT, 0o600)
+                try:
+                    with self._file_lock(fd):
+                        if os.fstat(fd).st_size < COUNTER.size:
+                            os.ftruncate(fd, COUNTER.size)
+                    self._counter = mmap.mmap(fd, COUNTER.size)
+                finally:
+                    os.close(fd)
+            return self._counter
+
+    @staticmethod
+    @contextmanager
+    def _file_lock(fd: int) -> Iterator[None]:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _locked(self, name: str) -> Iterator[None]:
+        """An exclusive lock on root/<name> across processes (and threads: each call opens its own descriptor)."""
+        self._counter_map()  # creates root
+        fd = os.open(os.path.join(self.root, name), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            with self._file_lock(fd):
+                yield
+        finally:
+            os.close(fd)
+
+    def generation(self) -> int:
+        return COUNTER.unpack_from(self._counter_map())[0]
+
+    def invalidate(self, offering_id: Optional[int] = None) -> None:
+        """Drop one offering's gallery file, or all of them, and tell every process to recheck."""
+        with self._locked("generation.lock"):
+            self._invalidate(offering_id)
+
+    def _invalidate(self, offering_id: Optional[int]) -> None:
+        # Caller holds generation.lock
+        counter = self._counter_map()
+        COUNTER.pack_into(counter, 0, COUNTER.unpack_from(counter)[0] + 1)
+        names = [os.path.basename(self.path(offering_id))] if offering_id is not None else os.listdir(self.root)
+        for name in names:
+            if name.endswith(".gal"):
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except FileNotFoundError:
+                    pass
+
+    def sync(self, signature: str) -> bool:
+        """
+        Invalidate everything unless root/signature already records `signature`, the state of
+        the data galleries are built from, then record it. For worker startup: the database may
+        have changed while no worker ran, but of several workers starting on the same database
+        only the first wipes the store. Returns True if it did.
+        """
+        path = os.path.join(self.root, "signature")
+        with self._locked("generation.lock"):
+            try:
+                with open(path) as handle:
+                    if handle.read() == signature:
+                        return False
+            except FileNotFoundError:
+                pass
+            self._invalidate(None)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as handle:
+                handle.write(signature)
+            os.replace(tmp_path, path)
+        return True
+
+    @contextmanager
+    def build_lock(self, offering_id: int) -> Iterator[None]:
+        """Held while building an offering's gallery, so concurrent misses in other workers wait and map the result."""
+        with self._locked(f"offering_{offering_id}.lock"):
+            yield
+
+    def publish(
+        self, offering_id: int, generation: int, student_ids: "np.ndarray", counts: "np.ndarray", matrix: "QuantizedMatrix"
+    ) -> bool:
+        """Write a gallery built at `generation`; False (nothing published) if an invalidation happened since."""
+        import numpy as np
+
+        path = self.path(offering_id)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        arrays = [
+            np.ascontiguousarray(student_ids, dtype="<i8"),
+            np.ascontiguousarray(counts, dtype="<i8"),
+            np.ascontiguousarray(matrix.scales if matrix.scales is not None else np.empty(0), dtype="<f4"),
+            np.ascontiguousarray(matrix.codes),
+        ]
+        header = HEADER.pack(
+            MAGIC, FORMAT_VERSION, generation, matrix.precision.encode(), matrix.dim, len(student_ids), len(matrix)
+        )
+        try:
+            with open(tmp_path, "wb") as handle:
+                handle.write(header.ljust(HEADER_SIZE, b"\0"))
+                offset = HEADER_SIZE
+                for array in arrays:
+                    handle.write(b"\0" * (_aligned(offset) - offset))
+                    if array.nbytes:  # an empty array's view can't be cast to bytes
+                        handle.write(memoryview(array).cast("B"))
+                    offset = _aligned(offset) + array.nbytes
+            with self._locked("generation.lock"):
+                if self.generation() == generation:
+                    os.replace(tmp_path, path)
+                    return True
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return False
+
+    def load(
+        self, offering_id: int, max_age_seconds: float
+    ) -> Optional[Tuple[Tuple[int, int], "np.ndarray", "np.ndarray", "QuantizedMatrix"]]:
+        """
+        Map a published gallery read-only: ((generation, inode), student_ids, counts, matrix),
+        all views into the mapping. None if there is no usable file: missing, older than
+        `max_age_seconds` (which catches writes that never invalidated), stored at another
+        precision, or malformed.
+        """
+        import numpy as np
+
+        from .quantization import QuantizedMatrix
+
+        try:
+            fd = os.open(self.path(offering_id), os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        try:
+            stat = os.fstat(fd)
+            if stat.st_size < HEADER_SIZE or time.time() - stat.st_mtime >= max_age_seconds:
+                return None
+            mapping = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+
+        magic, version, generation, precision, dim, students, rows = HEADER.unpack_from(mapping)
+        precision = precision.rstrip(b"\0").decode()
+        if magic != MAGIC or version != FORMAT_VERSION or precision != self.precision:
+            return None
+        layout = [("<i8", students), ("<i8", students), ("<f4", rows if precision == "int8" else 0), (precision, rows * dim)]
+        arrays = []
+        offset = HEADER_SIZE
+        for dtype, count in layout:
+            offset = _aligned(offset)
+            if offset + np.dtype(dtype).itemsize * count > len(mapping):
+                return None
+            arrays.append(np.frombuffer(mapping, dtype=dtype, count=count, offset=offset))
+            offset += arrays[-1].nbytes
+        student_ids, counts, scales, codes = arrays
+        matrix = QuantizedMatrix(codes.reshape(rows, dim), scales if precision == "int8" else None, precision)
+        return (generation, stat.st_ino), student_ids, counts, matrix
+
+
+# POSIX only: the store relies on flock, and Windows can't rename over or delete a file that
+# another process has mapped. Elsewhere (or with face_gallery_dir unset) galleries stay per process.
+gallery_store = (
+    SharedGalleryStore(settings.face_gallery_dir, settings.face_vector_precision)
+    if settings.face_gallery_dir and fcntl is not None
+    else None
+)
@@ -0,0 +1,103 @@
+import base64
+import hashlib
+import hmac
+import os
+import time
+from typing import Optional, Union
+
+from .config import get_settings
+
+settings = get_settings()
+
+VARIANTS = ("full", "thumb")
+
+
+class FaceImageStore:
+    """
+    Content-addressed files for face review images, outside the database. An image is
+    stored once under its SHA-256 digest (root/ab/abcdef....jpg) next to a small JPEG
+    thumbnail, so identical uploads share files and a digest's content never changes,
+    which lets a signed URL be cached for as long as it is valid.
+    """
+
+    def __init__(self, root: str, thumbnail_size: int):
+        self.root = root
+        self.thumbnail_size = thumbnail_size
+
+    def path(self, digest: str, variant: str = "full") -> str:
+        suffix = "_thumb.jpg" if variant == "thumb" else ".jpg"
+        return os.path.join(self.root, digest[:2], digest + suffix)
+
+    def put(self, image: Union[bytes, bytearray, str]) -> str:
+        """Store an encoded image (raw bytes or base64 data URL) and its thumbnail; returns the digest."""
+        if isinstance(image, str):
+            image = base64.b64decode(image.split(",", 1)[1] if "," in image else image)
+        data = bytes(image)
+        digest = hashlib.sha256(data).hexdigest()
+        if not os.path.exists(self.path(digest)):
+            os.makedirs(os.path.dirname(self.path(digest)), exist_ok=True)
+            self._write(self.path(digest, "thumb"), self._thumbnail(data))
+            self._write(self.path(digest), data)
+        return digest
+
+    def _thumbnail(self, data: bytes) -> bytes:
+        # OpenCV is imported on first upload so routes that only build signed URLs don't load it
+        import cv2
+        import numpy as np
+
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Unable to decode image")
+        h, w = image.shape[:2]
+        scale = min(1.0, self.thumbnail_size / max(h, w))
+        if scale < 1.0:
+            image = cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+        ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 80])
+        if not ok:
+            raise ValueError("Unable to encode thumbnail")
+        return encoded.tobytes()
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        # Write-then-rename so a concurrent reader never serves a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as handle:
+            handle.write(data)
+        os.replace(tmp_path, path)
+
+    def delete(self, digest: str) -> None:
+        for variant in VARIANTS:
+            try:
+                os.remove(self.path(digest, variant))
+            except FileNotFoundError:
+                pass
+
+
+face_image_store = FaceImageStore(settings.face_image_store_dir, settings.face_thumbnail_size)
+
+
+def _signature(digest: str, variant: str, expires: int) -> str:
+    message = f"{digest}:{variant}:{expires}".encode()
+    return hmac.new(settings.secret_key.encode(), message, hashlib.sha256).hexdigest()[:32]
+
+
+def face_image_url(digest: Optional[str], variant: str = "full") -> Optional[str]:
+    """
+    Signed URL for a stored image. <img> tags can't send the bearer token, so the signature is
+    the credential, and it expires. The expiry is rounded up to a whole face_image_url_ttl_seconds
+    period, so a URL stays valid for one to two periods and repeated listings within a period
+    hand out the same URL, which the browser keeps serving from its cache.
+    """
+    if not digest:
+        return None
+    ttl = settings.face_image_url_ttl_seconds
+    expires = (int(time.time()) // ttl + 2) * ttl
+    return f"/faces/images/{digest}/{variant}?exp={expires}&sig={_signature(digest, variant, expires)}"
+
+
+def verify_face_image_signature(digest: str, variant: str, expires: int, signature: str) -> bool:
+    return (
+        variant in VARIANTS
+        and expires > time.time()
+        and hmac.compare_digest(_signature(digest, variant, expires), signature)
+    )
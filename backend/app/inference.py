@@ -0,0 +1,213 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, TypeVar
+
+from fastapi import HTTPException, status
+
+from .config import get_settings
+from .metrics import face_stage_seconds
+
+T = TypeVar("T")
+
+settings = get_settings()
+
+
+class InferenceBusyError(RuntimeError):
+    pass
+
+
+class InferenceUnavailableError(InferenceBusyError):
+    """The out-of-process face worker could not be reached (settings.face_inference_mode = "worker")."""
+
+
+def loaded_face_service():
+    """
+    app.face_service if this process has imported it, else None. Nothing imports face_service
+    (and with it OpenCV and NumPy) at module level: the face routes import it inside their
+    handlers, on first use, and callers that only read or reset face state (metrics, cache
+    invalidation, shutdown) use this instead: in a process that never served a face route
+    there is no state to touch.
+    """
+    return sys.modules.get(f"{__package__}.face_service")
+
+
+class InferencePool:
+    """
+    Bounded executor for face inference, separate from FastAPI's default threadpool so a
+    burst of verify requests can't starve auth and list endpoints. Each worker thread
+    owns its own YuNet/SFace instances (see face_service._per_thread), and OpenCV's
+    internal thread count is split between the workers instead of oversubscribing cores.
+    At most `workers + queue_depth` jobs are accepted; beyond that callers get
+    InferenceBusyError straight away instead of queueing unboundedly.
+    Nothing from OpenCV is imported until the first job (or warm_up()), so workers that
+    never serve a face route don't pay for it.
+    """
+
+    def __init__(self, workers: int, queue_depth: int, opencv_threads: int = 0):
+        self.workers = max(1, workers)
+        self.queue_depth = max(0, queue_depth)
+        self.opencv_threads = opencv_threads or max(1, (os.cpu_count() or 1) // self.workers)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._create_executor()
+            return self._executor
+
+    def _create_executor(self) -> ThreadPoolExecutor:
+        import cv2
+
+        cv2.setNumThreads(self.opencv_threads)
+        return ThreadPoolExecutor(
+            max_workers=self.workers,
+            thread_name_prefix="face-inference",
+            initializer=self._init_worker,
+        )
+
+    @staticmethod
+    def _init_worker() -> None:
+        import cv2
+
+        from . import face_service
+
+        try:
+            face_service.warm_up()
+        except (RuntimeError, ValueError, cv2.error):
+            # Missing models or a misconfigured backend surface on the first real call with a proper error
+            pass
+
+    @property
+    def in_flight(self) -> int:
+        """Jobs running or waiting in the queue."""
+        return self._in_flight
+
+    def _release(self, _: Future) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+    def submit(self, fn: Callable[..., T], *args: Any) -> "Future[T]":
+        executor = self._get_executor()
+        with self._lock:
+            if self._in_flight >= self.workers + self.queue_depth:
+                raise InferenceBusyError("Face inference queue is full")
+            self._in_flight += 1
+        try:
+            future = executor.submit(self._timed, time.perf_counter(), fn, *args)
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _timed(self, submitted_at: float, fn: Callable[..., T], *args: Any) -> T:
+        # How long the job sat in the queue before a worker picked it up
+        face_stage_seconds.observe(time.perf_counter() - submitted_at, "queue_wait")
+        return self._call(fn, *args)
+
+    def _call(self, fn: Callable[..., T], *args: Any) -> T:
+        return fn(*args)
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def warm_up(self) -> List[Future]:
+        """
+        Start every worker now, which imports the face stack and loads each worker's models,
+        instead of on the first face request. Returns without waiting for the workers.
+        """
+        from . import face_service
+
+        return [self.submit(face_service.warm_up) for _ in range(self.workers)]
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=True)
+
+
+class RemoteInferencePool(InferencePool):
+    """
+    InferencePool whose jobs run in face worker processes (python -m app.face_worker) instead
+    of this one, so a verify burst can't take CPU from the JSON routes. Same bounds and
+    interface: each pool thread keeps one Unix socket connection to the worker and blocks on
+    it while the job runs there. Only the face_service entry points the worker exposes
+    (face_worker.JOBS) can be submitted, by name. The models never load here, but the routes
+    still import face_service (and so OpenCV) for those functions and its error types.
+    """
+
+    def __init__(self, socket_path: str, workers: int, queue_depth: int, timeout: float):
+        super().__init__(workers, queue_depth, opencv_threads=1)
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _create_executor(self) -> ThreadPoolExecutor:
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="face-worker-client")
+
+    def _call(self, fn: Callable[..., T], *args: Any) -> T:
+        from .face_worker import FaceWorkerClient
+
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = FaceWorkerClient(self.socket_path, self.timeout)
+        return client.call(fn.__name__, args)
+
+
+if settings.face_inference_mode == "worker":
+    inference_pool: InferencePool = RemoteInferencePool(
+        settings.face_worker_socket,
+        workers=settings.face_inference_workers,
+        queue_depth=settings.face_inference_queue_depth,
+        timeout=settings.face_worker_timeout_seconds,
+    )
+else:
+    inference_pool = InferencePool(
+        workers=settings.face_inference_workers,
+        queue_depth=settings.face_inference_queue_depth,
+        opencv_threads=settings.face_opencv_threads,
+    )
+
+
+async def run_face_inference(fn: Callable[..., T], *args: Any) -> T:
+    """Run a face_service call on the inference pool, mapping failures to HTTP errors."""
+    try:
+        return await inference_pool.run(fn, *args)
+    except HTTPException:
+        raise
+    except Exception as exc:
+        raise inference_http_error(exc) from exc
+
+
+def inference_http_error(exc: Exception) -> HTTPException:
+    """The HTTPException run_face_inference raises for a failed face_service job."""
+    from . import face_service
+
+    if isinstance(exc, InferenceUnavailableError):
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Face recognition is unavailable. Please retry in a moment.",
+            headers={"Retry-After": "5"},
+        )
+    if isinstance(exc, InferenceBusyError):
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Face recognition is busy. Please retry in a moment.",
+            headers={"Retry-After": "1"},
+        )
+    if isinstance(exc, face_service.FaceQualityError):
+        return HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(exc),
+            headers={"X-Face-Quality-Reject": exc.reason},
+        )
+    if isinstance(exc, ValueError):
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Error processing image: {str(exc)}")
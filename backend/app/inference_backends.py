@@ -0,0 +1,139 @@
+import threading
+from typing import Dict, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from .config import get_settings
+
+settings = get_settings()
+
+BACKENDS = ("opencv", "onnxruntime")
+
+# settings.face_ort_graph_optimization -> onnxruntime.GraphOptimizationLevel member
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+
+def _blob(crops: Sequence[np.ndarray]) -> np.ndarray:
+    # Same preprocessing as FaceRecognizerSF.feature: 112x112, BGR->RGB, no scaling or mean
+    return cv2.dnn.blobFromImages(list(crops), 1.0, (112, 112), (0, 0, 0), swapRB=True, crop=False)
+
+
+class RecognitionBackend:
+    """
+    Runtime for the SFace network. face_service.embed_aligned_faces goes through one of
+    these, so the runtime can be chosen per host (settings.face_inference_backend) without
+    touching the pipeline. embed() takes aligned 112x112 BGR crops and returns the raw,
+    unnormalized features, one row per crop.
+    """
+
+    name = ""
+
+    def embed(self, crops: Sequence[np.ndarray]) -> np.ndarray:
+        raise NotImplementedError
+
+
+class OpenCVRecognitionBackend(RecognitionBackend):
+    """cv2.dnn on DNN_BACKEND_OPENCV / DNN_TARGET_CPU. Nets mutate state on forward, so use one per thread."""
+
+    name = "opencv"
+
+    def __init__(self, model_path: str):
+        self.net = cv2.dnn.readNetFromONNX(model_path)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        # None until the first multi-crop call tells us whether the net accepts batched input
+        self.batching = None
+
+    def _forward(self, crops: Sequence[np.ndarray]) -> np.ndarray:
+        self.net.setInput(_blob(crops))
+        features = self.net.forward()
+        if features.shape[0] != len(crops):
+            raise ValueError("Recognition backend returned an unexpected batch shape")
+        return features.reshape(len(crops), -1)
+
+    def embed(self, crops: Sequence[np.ndarray]) -> np.ndarray:
+        if len(crops) > 1 and self.batching is not False:
+            try:
+                features = self._forward(crops)
+                if self.batching is None:
+                    # One-time parity check of every row against the single-crop path, so a net
+                    # that mixes up or broadcasts rows across the batch is caught too
+                    single = np.vstack([self._forward([crop]) for crop in crops])
+                    self.batching = bool(np.allclose(features, single, atol=1e-3))
+                    return features if self.batching else single
+                if self.batching:
+                    return features
+            except (cv2.error, ValueError):
+                self.batching = False
+        return np.vstack([self._forward([crop]) for crop in crops])
+
+
+class OnnxRuntimeRecognitionBackend(RecognitionBackend):
+    """
+    ONNX Runtime on the CPU execution provider. InferenceSession.run is thread-safe, so every
+    inference worker shares one session, and one copy of the weights, per configuration.
+    """
+
+    name = "onnxruntime"
+
+    _sessions: Dict[Tuple[str, int, int, str], object] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, model_path: str, intra_op_threads: int = 0, inter_op_threads: int = 0, graph_optimization: str = "all"):
+        self.session = self._session(model_path, intra_op_threads, inter_op_threads, graph_optimization)
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # The published SFace export has a fixed batch of 1; a symbolic batch dimension takes any size
+        self.batching = not isinstance(model_input.shape[0], int)
+
+    @classmethod
+    def _session(cls, model_path: str, intra_op_threads: int, inter_op_threads: int, graph_optimization: str):
+        key = (model_path, intra_op_threads, inter_op_threads, graph_optimization)
+        with cls._lock:
+            session = cls._sessions.get(key)
+            if session is None:
+                try:
+                    import onnxruntime as ort
+                except ImportError as exc:
+                    raise RuntimeError("face_inference_backend is 'onnxruntime' but onnxruntime is not installed") from exc
+                if graph_optimization not in GRAPH_OPTIMIZATION_LEVELS:
+                    raise ValueError(
+                        f"Unknown graph optimization level {graph_optimization!r}; "
+                        f"expected one of {', '.join(GRAPH_OPTIMIZATION_LEVELS)}"
+                    )
+                options = ort.SessionOptions()
+                options.intra_op_num_threads = intra_op_threads  # 0 = ONNX Runtime's default
+                options.inter_op_num_threads = inter_op_threads
+                if inter_op_threads > 1:
+                    # Inter-op threads are only used when independent graph branches may run in parallel
+                    options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+                options.graph_optimization_level = getattr(ort.GraphOptimizationLevel, GRAPH_OPTIMIZATION_LEVELS[graph_optimization])
+                session = cls._sessions[key] = ort.InferenceSession(
+                    model_path, sess_options=options, providers=["CPUExecutionProvider"]
+                )
+        return session
+
+    def embed(self, crops: Sequence[np.ndarray]) -> np.ndarray:
+        blob = _blob(crops)
+        batches = [blob] if self.batching else [blob[i:i + 1] for i in range(len(blob))]
+        features = [self.session.run(None, {self.input_name: batch})[0].reshape(len(batch), -1) for batch in batches]
+        return np.vstack(features)
+
+
+def create_recognition_backend(name: str, model_path: str) -> RecognitionBackend:
+    if name == "opencv":
+        return OpenCVRecognitionBackend(model_path)
+    if name == "onnxruntime":
+        return OnnxRuntimeRecognitionBackend(
+            model_path,
+            intra_op_threads=settings.face_ort_intra_op_threads,
+            inter_op_threads=settings.face_ort_inter_op_threads,
+            graph_optimization=settings.face_ort_graph_optimization,
+        )
+    raise ValueError(f"Unknown face inference backend {name!r}; expected one of {', '.join(BACKENDS)}")
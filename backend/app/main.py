@@ -1,10 +1,18 @@
-from fastapi import FastAPI
+import time
+from typing import Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlalchemy import text
 from sqlmodel import Session
 
 from .config import get_settings
-from .crud import ensure_curriculum_courses
+from .crud import ensure_curriculum_courses, purge_face_review_images, save_institution_index, sync_face_galleries
 from .database import init_db, engine
+from .inference import InferenceBusyError, inference_pool, loaded_face_service
+from .metrics import http_request_seconds, registry
 from .routers import admin, attendance, auth, face, student, teacher
 
 settings = get_settings()
@@ -18,6 +26,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # Label by route template (/attendance/{session_id}/verify-face), not the raw path
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        http_request_seconds.observe(time.perf_counter() - start, request.method, route, str(status_code))
+
+
 app.include_router(auth.router)
 app.include_router(admin.router)
 app.include_router(teacher.router)
@@ -31,6 +54,22 @@ def on_startup():
     init_db()
     with Session(engine) as session:
         ensure_curriculum_courses(session)
+        purge_face_review_images(session)
+        # Shared gallery files outlive the workers; the database may have changed while none was running
+        sync_face_galleries(session)
+    if settings.face_warm_up_on_startup:
+        # Load OpenCV and the models on every inference worker now instead of on the first request
+        for job in inference_pool.warm_up():
+            try:
+                job.result()
+            except Exception:
+                pass  # e.g. missing models; /ready reports them
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    inference_pool.shutdown()
+    save_institution_index()
 
 
 @app.get("/health")
@@ -38,3 +77,89 @@ def health():
     return {"status": "ok"}
 
 
+registry.gauge("face_inference_in_flight", "Face inference jobs running or queued", lambda: inference_pool.in_flight)
+registry.gauge(
+    "face_inference_capacity",
+    "Jobs the inference pool accepts before answering 503",
+    lambda: inference_pool.workers + inference_pool.queue_depth,
+)
+
+
+# Until the first face request imports face_service, its caches and counters are all zero.
+# In worker mode probes and quality checks happen in the face worker, which reports its totals.
+def _probe_cache_counts() -> Tuple[int, int]:
+    if settings.face_inference_mode == "worker":
+        from .face_worker import worker_totals
+
+        totals = worker_totals()
+        return totals["probe_hits"], totals["probe_misses"]
+    face_service = loaded_face_service()
+    if face_service is None:
+        return 0, 0
+    return face_service.probe_cache.hits, face_service.probe_cache.misses
+
+
+def _cache_requests() -> dict:
+    probe_hits, probe_misses = _probe_cache_counts()
+    counts = {("probe", "hit"): probe_hits, ("probe", "miss"): probe_misses}
+    face_service = loaded_face_service()
+    if face_service is not None:
+        counts[("gallery", "hit")] = face_service.gallery_cache.hits
+        counts[("gallery", "miss")] = face_service.gallery_cache.misses
+    return counts
+
+
+def _probe_cache_hit_ratio() -> float:
+    probe_hits, probe_misses = _probe_cache_counts()
+    return probe_hits / max(1, probe_hits + probe_misses)
+
+
+def _quality_rejects() -> dict:
+    if settings.face_inference_mode == "worker":
+        from .face_worker import worker_totals
+
+        stats = worker_totals()["quality_rejects"]
+    else:
+        face_service = loaded_face_service()
+        stats = face_service.quality_stats() if face_service is not None else {}
+    return {(reason,): count for reason, count in stats.items()}
+
+
+registry.counter("face_cache_requests_total", "Probe and gallery cache lookups by result", _cache_requests, ("cache", "result"))
+registry.gauge("face_probe_cache_hit_ratio", "Share of probe cache lookups answered from the cache", _probe_cache_hit_ratio)
+registry.counter("face_quality_rejects_total", "Frames rejected by the quality gate before recognition", _quality_rejects, ("reason",))
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+def _check_database() -> None:
+    with Session(engine) as session:
+        session.exec(text("SELECT 1"))
+
+
+@app.get("/ready")
+async def ready():
+    """Deep readiness: the database answers and an inference worker has its models loaded."""
+    checks = {}
+    try:
+        await run_in_threadpool(_check_database)
+        checks["database"] = "ok"
+    except Exception as exc:
+        checks["database"] = f"error: {exc}"
+    from . import face_service
+
+    try:
+        await inference_pool.run(face_service.warm_up)
+        checks["models"] = "ok"
+    except InferenceBusyError:
+        # Every worker is busy with real inference, which needs the models anyway
+        checks["models"] = "busy"
+    except Exception as exc:
+        checks["models"] = f"error: {exc}"
+    healthy = all(result in ("ok", "busy") for result in checks.values())
+    return JSONResponse({"status": "ready" if healthy else "unavailable", "checks": checks}, status_code=200 if healthy else 503)
+
+
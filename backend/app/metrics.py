@@ -0,0 +1,165 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+# Latency buckets in seconds, from a cached probe (~100us) up to a stalled commit
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+INF_LABEL = 'le="+Inf"'
+
+_capture = threading.local()
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series: Dict[LabelValues, List[float]] = {}  # bucket counts..., sum, count
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        records = getattr(_capture, "records", None)
+        if records is not None:
+            records.append((self.name, value, labels))
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {_format_value(cumulative)}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, INF_LABEL)} {_format_value(values[-1])}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(values[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {_format_value(values[-1])}")
+        return lines
+
+
+class CallbackMetric:
+    """A gauge or counter whose samples are read from the owning component at scrape time."""
+
+    def __init__(self, name: str, documentation: str, kind: str, collect: Callable[[], Dict[LabelValues, float]], labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.collect = collect
+        self.labelnames = tuple(labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    """
+    Minimal Prometheus text-format (0.0.4) exporter: histograms recorded in-process plus
+    gauges/counters that read live values from the inference pool and caches on scrape.
+    """
+
+    def __init__(self):
+        self._metrics: List[object] = []
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str, collect: Callable[[], float]) -> None:
+        self._metrics.append(CallbackMetric(name, documentation, "gauge", lambda: {(): collect()}))
+
+    def counter(self, name: str, documentation: str, collect: Callable[[], Dict[LabelValues, float]], labelnames: Sequence[str] = ()) -> None:
+        self._metrics.append(CallbackMetric(name, documentation, "counter", collect, labelnames))
+
+    def replay(self, observations: Sequence[Tuple[str, float, Sequence[str]]]) -> None:
+        """Record histogram observations made in another process (see capture_observations)."""
+        histograms = {metric.name: metric for metric in self._metrics if isinstance(metric, Histogram)}
+        for name, value, labels in observations:
+            if name in histograms:
+                histograms[name].observe(value, *labels)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_request_seconds = registry.histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ("method", "route", "status"),
+)
+face_stage_seconds = registry.histogram(
+    "face_stage_duration_seconds",
+    "Time spent in each stage of the face recognition and attendance pipeline",
+    ("stage",),
+)
+
+recognition_batch_size = registry.histogram(
+    "face_recognition_batch_size",
+    "Aligned crops per SFace forward pass after cross-request batching",
+    buckets=(1, 2, 4, 8, 16, 32),
+)
+
+
+@contextmanager
+def capture_observations() -> Iterator[List[Tuple[str, float, LabelValues]]]:
+    """
+    Also collect every histogram observation this thread makes, as (name, value, labels);
+    the face worker sends them back with each reply so the API's /metrics includes them.
+    """
+    records: List[Tuple[str, float, LabelValues]] = []
+    _capture.records = records
+    try:
+        yield records
+    finally:
+        _capture.records = None
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a block into face_stage_duration_seconds{stage=name}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        face_stage_seconds.observe(time.perf_counter() - start, name)
@@ -157,7 +157,9 @@ class AttendanceRecord(SQLModel, table=True):
 class FaceEmbedding(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id", unique=True)
-    vector: str
+    embedding: bytes  # Little-endian float32 samples, unit-normalized (see face_service.pack_embeddings)
+    sample_count: int = Field(default=0)
+    model_version: Optional[str] = None
     captured_at: datetime = Field(default_factory=datetime.utcnow)
 
     user: User = Relationship(back_populates="face_embedding")
@@ -166,10 +168,18 @@ class FaceEmbedding(SQLModel, table=True):
 class FaceUpdateRequest(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id")
-    vector: str  # Serialized new embeddings
-    image_data: str  # Store one representative image as base64 for admin review (optional but good for UI)
+    embedding: bytes  # Packed new embeddings, same layout as FaceEmbedding.embedding
+    sample_count: int = Field(default=0)
+    model_version: Optional[str] = None
+    image_data: str = ""  # Legacy inline base64 preview; migrate_db.py moves these to the image store
+    image_digest: Optional[str] = Field(default=None, index=True)  # Preview in app.image_store
     created_at: datetime = Field(default_factory=datetime.utcnow)
-    status: str = Field(default="PENDING")  # PENDING, APPROVED, REJECTED
+    status: str = Field(default="PENDING", index=True)  # PENDING, APPROVED, REJECTED
+    decided_at: Optional[datetime] = None
+    # Closest other enrolled user when this face scored above face_duplicate_threshold against them.
+    # Not a foreign key so `user` stays the only relationship to User.
+    duplicate_user_id: Optional[int] = None
+    duplicate_score: Optional[float] = None
 
     user: User = Relationship()
 
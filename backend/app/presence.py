@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from .config import get_settings
+
+settings = get_settings()
+
+
+class PresenceTracker:
+    """
+    In-memory view of who is already marked present in each attendance session, plus a
+    StudentProfile id -> (student_id, full name) map. During continuous capture most frames
+    are of students who are already present; with this they are answered without touching
+    the database. detected_at is still refreshed once every `refresh_seconds`.
+
+    Both maps are bounded, since sessions can end and profiles can change in other worker
+    processes. A session's marks are dropped once none of them is recent enough to skip a
+    write. Labels expire after `label_ttl_seconds`, and only the `max_labels` most recently
+    used are kept; forget_labels drops them at once when this process changes a profile.
+    """
+
+    def __init__(self, refresh_seconds: float, label_ttl_seconds: float, max_labels: int = 10_000):
+        self.refresh_seconds = refresh_seconds
+        self.label_ttl_seconds = label_ttl_seconds
+        self.max_labels = max_labels
+        self._written: Dict[int, Dict[int, float]] = {}
+        self._last_marked: Dict[int, float] = {}
+        self._labels: "OrderedDict[int, Tuple[float, Tuple[str, str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def needs_write(self, session_id: int, student_pk: int) -> bool:
+        with self._lock:
+            last_written = self._written.get(session_id, {}).get(student_pk)
+        return last_written is None or time.monotonic() - last_written >= self.refresh_seconds
+
+    def mark(self, session_id: int, student_pks: Iterable[int]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            written = self._written.setdefault(session_id, {})
+            for student_pk in student_pks:
+                written[student_pk] = now
+            self._last_marked[session_id] = now
+            # Sessions with no mark inside the refresh window have nothing left to skip
+            for stale_id in [sid for sid, marked in self._last_marked.items() if now - marked >= self.refresh_seconds]:
+                del self._last_marked[stale_id]
+                self._written.pop(stale_id, None)
+
+    def forget_session(self, session_id: int) -> None:
+        with self._lock:
+            self._written.pop(session_id, None)
+            self._last_marked.pop(session_id, None)
+
+    def label(self, student_pk: int) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            entry = self._labels.get(student_pk)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] >= self.label_ttl_seconds:
+                del self._labels[student_pk]
+                return None
+            self._labels.move_to_end(student_pk)
+            return entry[1]
+
+    def remember_labels(self, labels: Dict[int, Tuple[str, str]]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for student_pk, label in labels.items():
+                self._labels[student_pk] = (now, label)
+                self._labels.move_to_end(student_pk)
+            while len(self._labels) > self.max_labels:
+                self._labels.popitem(last=False)
+
+    def forget_labels(self, student_pks: Optional[Iterable[int]] = None) -> None:
+        """Drop the labels of these students, or all of them."""
+        with self._lock:
+            if student_pks is None:
+                self._labels.clear()
+                return
+            for student_pk in student_pks:
+                self._labels.pop(student_pk, None)
+
+
+attendance_presence = PresenceTracker(
+    refresh_seconds=settings.attendance_refresh_seconds,
+    label_ttl_seconds=settings.attendance_label_ttl_seconds,
+)
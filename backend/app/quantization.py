@@ -0,0 +1,109 @@
+from typing import Optional, Sequence
+
+import numpy as np
+
+PRECISIONS = ("float32", "float16", "int8")
+
+# Rows widened to float32 per BLAS call: 4096 x 128 x 4 bytes = 2 MB, small enough to stay in cache
+CHUNK_ROWS = 4096
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Rows scaled to unit length; all-zero rows are left as they are."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class QuantizedMatrix:
+    """
+    Rows of unit-length vectors stored as float32, float16 (half the memory) or int8 with one
+    float32 scale per row (a quarter; row ~= codes * scale with scale = max|row| / 127).
+
+    dot() quantizes the probe the same way, so scoring is a float16 or int8 dot product. NumPy
+    has no fast kernels for either, so codes are widened to float32 a chunk at a time and BLAS
+    does the arithmetic; for int8 the products and their sum stay below 2**24 and are exact
+    integers. exact_dot() rescores chosen rows, dequantized, with the float32 probe, which is
+    how callers re-rank their top candidates; no float32 copy is kept, so the rows' own
+    quantization error remains.
+    """
+
+    def __init__(self, codes: np.ndarray, scales: Optional[np.ndarray], precision: str):
+        self.codes = codes
+        self.scales = scales
+        self.precision = precision
+
+    @classmethod
+    def encode(cls, rows: np.ndarray, precision: str = "float32") -> "QuantizedMatrix":
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision!r}; expected one of {', '.join(PRECISIONS)}")
+        rows = np.asarray(rows, dtype=np.float32)
+        if precision != "int8":
+            return cls(np.ascontiguousarray(rows, dtype=precision), None, precision)
+        scales = np.abs(rows).max(axis=1) / 127.0 if len(rows) else np.empty(0, dtype=np.float32)
+        scales[scales == 0] = 1.0
+        codes = np.round(rows / scales[:, None]).astype(np.int8)
+        return cls(np.ascontiguousarray(codes), scales.astype(np.float32), precision)
+
+    @classmethod
+    def empty(cls, dim: int, precision: str = "float32") -> "QuantizedMatrix":
+        return cls.encode(np.empty((0, dim), dtype=np.float32), precision)
+
+    @classmethod
+    def concat(cls, parts: Sequence["QuantizedMatrix"]) -> "QuantizedMatrix":
+        precision = parts[0].precision
+        codes = np.concatenate([part.codes for part in parts])
+        scales = np.concatenate([part.scales for part in parts]) if precision == "int8" else None
+        return cls(codes, scales, precision)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def dim(self) -> int:
+        return self.codes.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def take(self, rows) -> "QuantizedMatrix":
+        """The selected rows (index array, boolean mask or slice) as a new matrix."""
+        scales = self.scales[rows] if self.scales is not None else None
+        return QuantizedMatrix(np.ascontiguousarray(self.codes[rows]), scales, self.precision)
+
+    def decode(self, rows=slice(None)) -> np.ndarray:
+        """The selected rows as float32."""
+        decoded = self.codes[rows].astype(np.float32)
+        if self.scales is not None:
+            decoded *= self.scales[rows][..., None]
+        return decoded
+
+    def _quantize_probes(self, probes: np.ndarray):
+        if self.precision == "float16":
+            return probes.astype(np.float16).astype(np.float32), None
+        scales = np.abs(probes).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(probes / scales[:, None]), scales.astype(np.float32)
+
+    def dot(self, probes: np.ndarray) -> np.ndarray:
+        """Scores of one probe (-> (rows,)) or a probe matrix (-> (probes, rows)) at the stored precision."""
+        probes = np.asarray(probes, dtype=np.float32)
+        single = probes.ndim == 1
+        probes = probes.reshape(-1, self.dim)
+        if self.precision == "float32":
+            scores = probes @ self.codes.T
+        else:
+            quantized, probe_scales = self._quantize_probes(probes)
+            scores = np.empty((len(probes), len(self)), dtype=np.float32)
+            for start in range(0, len(self), CHUNK_ROWS):
+                block = self.codes[start:start + CHUNK_ROWS].astype(np.float32)
+                scores[:, start:start + CHUNK_ROWS] = quantized @ block.T
+            if probe_scales is not None:
+                scores *= probe_scales[:, None]
+                scores *= self.scales[None, :]
+        return scores[0] if single else scores
+
+    def exact_dot(self, rows: np.ndarray, probe: np.ndarray) -> np.ndarray:
+        """Scores of the selected rows against the float32 probe (no probe quantization)."""
+        return self.decode(rows) @ np.asarray(probe, dtype=np.float32)
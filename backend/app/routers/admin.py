@@ -1,5 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session, select
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, func, select
 
 from ..auth import require_role
 from ..crud import (
@@ -9,15 +12,22 @@ from ..crud import (
     create_student,
     create_teacher,
     ensure_curriculum_courses,
+    find_duplicate_face,
+    index_face_embedding,
+    invalidate_face_galleries,
+    purge_face_review_images,
 )
 from ..database import get_session
-from ..models import Course, RoleEnum, TeacherProfile
+from ..image_store import face_image_url
+from ..models import Course, RoleEnum, TeacherProfile, User
 from ..schemas import (
     CourseCreateRequest,
     CourseOfferingCreateRequest,
     CourseOfferingResponse,
     CourseResponse,
     DashboardSummary,
+    FaceReviewItem,
+    FaceReviewPage,
     StudentCreateRequest,
     StudentResponse,
     StudentProvisionResponse,
@@ -197,6 +207,7 @@ def delete_course_offering(offering_id: int, session: Session = Depends(get_sess
     # However, user asked for "remove course", so we'll allow it.
     session.delete(offering)
     session.commit()
+    invalidate_face_galleries(offering_id)
     return {"message": "Course offering deleted"}
 
 
@@ -219,22 +230,60 @@ def list_students(session: Session = Depends(get_session)):
     return responses
 
 
-@router.get("/face-requests")
-def list_face_requests(session: Session = Depends(get_session)):
+@router.get("/face-requests", response_model=FaceReviewPage)
+def list_face_requests(
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    session: Session = Depends(get_session),
+):
     from ..models import FaceUpdateRequest
-    requests = session.exec(select(FaceUpdateRequest).where(FaceUpdateRequest.status == "PENDING")).all()
-    
-    result = []
-    for req in requests:
-        result.append({
-            "id": req.id,
-            "user_id": req.user_id,
-            "user_name": req.user.full_name,
-            "user_email": req.user.email,
-            "image_data": req.image_data,
-            "created_at": req.created_at
-        })
-    return result
+
+    pending = FaceUpdateRequest.status == "PENDING"
+    duplicate = aliased(User)
+    total = session.exec(select(func.count(FaceUpdateRequest.id)).where(pending)).one()
+    # Only metadata is selected; previews are fetched by the browser from the signed URLs
+    rows = session.exec(
+        select(
+            FaceUpdateRequest.id,
+            FaceUpdateRequest.user_id,
+            FaceUpdateRequest.image_digest,
+            FaceUpdateRequest.created_at,
+            User.full_name,
+            User.email,
+            FaceUpdateRequest.duplicate_user_id,
+            FaceUpdateRequest.duplicate_score,
+            duplicate.full_name,
+            duplicate.email,
+        )
+        .join(User, User.id == FaceUpdateRequest.user_id)
+        .join(duplicate, duplicate.id == FaceUpdateRequest.duplicate_user_id, isouter=True)
+        .where(pending)
+        .order_by(FaceUpdateRequest.created_at, FaceUpdateRequest.id)
+        .offset((page - 1) * page_size)
+        .limit(page_size)
+    ).all()
+
+    items = []
+    for (
+        request_id, user_id, digest, created_at, full_name, email,
+        duplicate_user_id, duplicate_score, duplicate_name, duplicate_email,
+    ) in rows:
+        items.append(
+            FaceReviewItem(
+                id=request_id,
+                user_id=user_id,
+                user_name=full_name,
+                user_email=email,
+                thumbnail_url=face_image_url(digest, "thumb"),
+                image_url=face_image_url(digest),
+                created_at=created_at,
+                duplicate_user_id=duplicate_user_id,
+                duplicate_user_name=duplicate_name,
+                duplicate_user_email=duplicate_email,
+                duplicate_score=duplicate_score,
+            )
+        )
+    return FaceReviewPage(items=items, total=total, page=page, page_size=page_size)
 
 
 @router.post("/face-requests/{request_id}/approve")
@@ -247,19 +296,46 @@ def approve_face_request(request_id: int, session: Session = Depends(get_session
         
     if request.status != "PENDING":
         raise HTTPException(status_code=400, detail="Request already processed")
+
+    # Re-check against faces enrolled since the request was filed; a match the reviewer
+    # hasn't been shown is recorded on the request and sent back instead of approved
+    duplicate_user_id, duplicate_score = find_duplicate_face(session, request.user_id, request.embedding)
+    unseen_duplicate = duplicate_user_id is not None and duplicate_user_id != request.duplicate_user_id
+    request.duplicate_user_id, request.duplicate_score = duplicate_user_id, duplicate_score
+    if unseen_duplicate:
+        session.add(request)
+        session.commit()
+        raise HTTPException(
+            status_code=409,
+            detail=f"Face resembles another enrolled user (score {duplicate_score:.2f}). Review the request again.",
+        )
         
     # Update the actual face embedding
     existing_embedding = session.exec(select(FaceEmbedding).where(FaceEmbedding.user_id == request.user_id)).first()
     if existing_embedding:
-        existing_embedding.vector = request.vector
+        existing_embedding.embedding = request.embedding
+        existing_embedding.sample_count = request.sample_count
+        existing_embedding.model_version = request.model_version
+        existing_embedding.captured_at = datetime.utcnow()
         session.add(existing_embedding)
     else:
-        # Should not happen given logic, but safe fallback
-        session.add(FaceEmbedding(user_id=request.user_id, vector=request.vector))
+        # First enrollment held back by the duplicate check
+        session.add(
+            FaceEmbedding(
+                user_id=request.user_id,
+                embedding=request.embedding,
+                sample_count=request.sample_count,
+                model_version=request.model_version,
+            )
+        )
         
     request.status = "APPROVED"
+    request.decided_at = datetime.utcnow()
     session.add(request)
     session.commit()
+    invalidate_face_galleries()
+    index_face_embedding(session)
+    purge_face_review_images(session)
     return {"message": "Request approved"}
 
 
@@ -275,8 +351,10 @@ def reject_face_request(request_id: int, session: Session = Depends(get_session)
         raise HTTPException(status_code=400, detail="Request already processed")
         
     request.status = "REJECTED"
+    request.decided_at = datetime.utcnow()
     session.add(request)
     session.commit()
+    purge_face_review_images(session)
     return {"message": "Request rejected"}
 
 
@@ -1,27 +1,43 @@
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import json
+from typing import TYPE_CHECKING, Optional, Union
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
 from sqlmodel import Session, select
 
-from ..auth import get_current_user, require_role
-from ..crud import record_detection
+from ..auth import get_current_user, require_role, user_from_token
+from ..crud import get_offering_gallery, record_detection, record_detections, student_labels
 from ..database import get_session
-from ..face_service import best_match, deserialize_embeddings, extract_embedding, to_vector
+from ..inference import InferenceBusyError, inference_pool, run_face_inference
+from ..metrics import stage
 from ..models import (
     AttendanceSession,
-    Enrollment,
     RoleEnum,
-    StudentProfile,
     TeacherProfile,
     User,
 )
+from ..presence import attendance_presence
 from ..schemas import (
     AttendanceDetectionPayload,
     AttendanceRecordResponse,
+    ClassroomMatch,
+    ClassroomRecognitionRequest,
+    ClassroomRecognitionResponse,
     FaceVerificationRequest,
     FaceVerificationResponse,
 )
+from ..uploads import image_upload_openapi, read_image_upload
+
+if TYPE_CHECKING:
+    import numpy as np
 
 router = APIRouter(prefix="/attendance", tags=["Attendance"])
 
+# Threshold for ArcFace embeddings (typically 0.4-0.6 works well)
+# Lower threshold for InsightFace/ArcFace, higher for basic methods
+MATCH_THRESHOLD = 0.50  # Adjusted for better face recognition models
+
 
 def _load_session(session: Session, session_id: int) -> AttendanceSession:
     attendance_session = session.get(AttendanceSession, session_id)
@@ -57,50 +73,43 @@ def ingest_detection(
     )
 
 
-@router.post("/{session_id}/verify-face", response_model=FaceVerificationResponse)
-def verify_face_attendance(
-    session_id: int,
-    payload: FaceVerificationRequest,
-    current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session),
-):
+def _load_face_session(session: Session, session_id: int, current_user: User) -> AttendanceSession:
     if current_user.role not in (RoleEnum.TEACHER, RoleEnum.ADMIN):
         raise HTTPException(status_code=403, detail="Face verification restricted")
+    with stage("load_session"):
+        attendance_session = _load_session(session, session_id)
+        _validate_teacher_access(session, attendance_session, current_user)
+    return attendance_session
 
-    attendance_session = _load_session(session, session_id)
-    _validate_teacher_access(session, attendance_session, current_user)
 
-    try:
-        if not payload.image_data:
-            raise HTTPException(status_code=400, detail="Image data is required")
-        if len(payload.image_data) < 100:
-            raise HTTPException(status_code=400, detail="Image data appears to be too short or invalid")
-        probe_vector = to_vector(extract_embedding(payload.image_data))
-    except HTTPException:
-        raise
-    except ValueError as exc:
-        raise HTTPException(status_code=400, detail=str(exc)) from exc
-    except Exception as exc:
-        raise HTTPException(status_code=400, detail=f"Error processing image: {str(exc)}") from exc
-
-    enrollments = session.exec(select(Enrollment).where(Enrollment.offering_id == attendance_session.offering_id)).all()
-    candidates = []
-    student_lookup: dict[int, StudentProfile] = {}
-    embedding_lookup: dict[int, str] = {}  # Store the deserialized embedding used for matching
-    for enrollment in enrollments:
-        student = session.get(StudentProfile, enrollment.student_id)
-        if not student:
-            continue
-        session.refresh(student, attribute_names=["user"])
-        session.refresh(student.user, attribute_names=["face_embedding"])
-        if not student.user.face_embedding or not student.user.face_embedding.vector:
-            continue
-        embeddings = deserialize_embeddings(student.user.face_embedding.vector)
-        candidates.append((student.id, embeddings))
-        student_lookup[student.id] = student
-        embedding_lookup[student.id] = embeddings  # Store the deserialized embedding
-
-    if not candidates:
+def _mark_present(session: Session, attendance_session: AttendanceSession, matches: list[tuple[int, float]]) -> None:
+    """Write attendance for matches that aren't already known present (or are due a detected_at refresh)."""
+    if attendance_session.active:
+        matches = [
+            (student_pk, score)
+            for student_pk, score in matches
+            if attendance_presence.needs_write(attendance_session.id, student_pk)
+        ]
+        if not matches:
+            return
+    # An inactive session falls through so record_detections raises the usual error
+    with stage("record"):
+        record_detections(session, attendance_session.id, [(student_pk, round(score, 3)) for student_pk, score in matches])
+
+
+def _session_still_active(session: Session, attendance_session: AttendanceSession) -> bool:
+    session.refresh(attendance_session)
+    return attendance_session.active
+
+
+def _match_probe(
+    session: Session, attendance_session: AttendanceSession, probe: "np.ndarray", include_embeddings: bool = True
+) -> FaceVerificationResponse:
+    probe_vector = json.dumps(probe.tolist()) if include_embeddings else None
+    with stage("load_gallery"):
+        gallery = get_offering_gallery(session, attendance_session.offering_id)
+
+    if not len(gallery):
         return FaceVerificationResponse(
             matched=False,
             message="No registered faces for this class yet.",
@@ -109,15 +118,13 @@ def verify_face_attendance(
             matched_embedding=None,
         )
 
-    best_id, best_score = best_match(probe_vector, candidates)
-    # Threshold for ArcFace embeddings (typically 0.4-0.6 works well)
-    # Lower threshold for InsightFace/ArcFace, higher for basic methods
-    threshold = 0.50  # Adjusted for better face recognition models
+    with stage("match"):
+        best_id, best_score = gallery.match(probe)
     matched_embedding = None
-    if best_id:
-        matched_embedding = embedding_lookup[best_id]  # Return the deserialized embedding that was matched
+    if best_id and include_embeddings:
+        matched_embedding = json.dumps(gallery.vector_for(best_id, probe).tolist())  # Return the gallery template that was matched
     
-    if not best_id or best_score < threshold:
+    if not best_id or best_score < MATCH_THRESHOLD:
         return FaceVerificationResponse(
             matched=False,
             confidence=best_score,
@@ -126,15 +133,229 @@ def verify_face_attendance(
             matched_embedding=matched_embedding,
         )
 
-    matched_student = student_lookup[best_id]
-    record = record_detection(session, session_id, matched_student.student_id, round(best_score, 3))
+    _mark_present(session, attendance_session, [(best_id, best_score)])
+    student_id, student_name = student_labels(session, [best_id])[best_id]
     return FaceVerificationResponse(
         matched=True,
-        student_id=matched_student.student_id,
-        student_name=matched_student.user.full_name,
+        student_id=student_id,
+        student_name=student_name,
         confidence=best_score,
         message="Attendance logged via face verification.",
         probe_embedding=probe_vector,
         matched_embedding=matched_embedding,
     )
 
+
+# Face endpoints are async so inference runs on the dedicated inference pool without
+# holding one of FastAPI's default threadpool slots; database work still goes through
+# run_in_threadpool because the session is synchronous.
+# Besides the JSON body they also accept the raw image as multipart/form-data or application/octet-stream.
+@router.post(
+    "/{session_id}/verify-face",
+    response_model=FaceVerificationResponse,
+    openapi_extra=image_upload_openapi(FaceVerificationRequest, "image"),
+)
+async def verify_face_attendance(
+    session_id: int,
+    request: Request,
+    include_embeddings: bool = Query(True, description="Return the probe and matched embeddings for debugging"),
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    attendance_session = await run_in_threadpool(_load_face_session, session, session_id, current_user)
+
+    payload, raw_images = await read_image_upload(request, FaceVerificationRequest)
+    image_data = raw_images[0] if raw_images else payload.image_data
+    if not image_data:
+        raise HTTPException(status_code=400, detail="Image data is required")
+    if len(image_data) < 100:
+        raise HTTPException(status_code=400, detail="Image data appears to be too short or invalid")
+    from ..face_service import extract_embedding
+
+    probe = await run_face_inference(extract_embedding, image_data, payload.face, payload.aligned)
+
+    return await run_in_threadpool(_match_probe, session, attendance_session, probe, include_embeddings)
+
+
+def _record_classroom(
+    session: Session, attendance_session: AttendanceSession, faces: "np.ndarray", probes: "np.ndarray"
+) -> ClassroomRecognitionResponse:
+    boxes = [[float(value) for value in face[:4]] for face in faces]
+    gallery = get_offering_gallery(session, attendance_session.offering_id)
+    assignments = gallery.assign(probes, MATCH_THRESHOLD)
+
+    _mark_present(session, attendance_session, [(student_id, score) for _, student_id, score in assignments])
+    names = student_labels(session, [student_id for _, student_id, _ in assignments])
+    matched_probes = {probe_index for probe_index, _, _ in assignments}
+    matches = [
+        ClassroomMatch(
+            student_id=names[student_id][0],
+            student_name=names[student_id][1],
+            confidence=score,
+            box=boxes[probe_index],
+        )
+        for probe_index, student_id, score in assignments
+    ]
+    return ClassroomRecognitionResponse(
+        faces_detected=len(faces),
+        matches=matches,
+        unmatched_boxes=[box for index, box in enumerate(boxes) if index not in matched_probes],
+        message=f"Marked {len(matches)} of {len(faces)} detected face(s) present.",
+    )
+
+
+@router.post(
+    "/{session_id}/recognize-classroom",
+    response_model=ClassroomRecognitionResponse,
+    openapi_extra=image_upload_openapi(ClassroomRecognitionRequest, "image"),
+)
+async def recognize_classroom(
+    session_id: int,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    attendance_session = await run_in_threadpool(_load_face_session, session, session_id, current_user)
+    if not attendance_session.active:
+        raise HTTPException(status_code=400, detail="Session is not active")
+
+    payload, raw_images = await read_image_upload(request, ClassroomRecognitionRequest)
+    image_data = raw_images[0] if raw_images else payload.image_data
+    if not image_data:
+        raise HTTPException(status_code=400, detail="Image data is required")
+    from ..face_service import extract_all_embeddings
+
+    faces, probes = await run_face_inference(extract_all_embeddings, image_data)
+
+    return await run_in_threadpool(_record_classroom, session, attendance_session, faces, probes)
+
+
+@router.websocket("/{session_id}/stream")
+async def stream_attendance(
+    websocket: WebSocket,
+    session_id: int,
+    token: str = Query(...),
+    session: Session = Depends(get_session),
+):
+    """
+    Continuous roll-taking over one WebSocket bound to an attendance session.
+
+    The client authenticates once (browsers can't set headers on WebSockets, so the bearer
+    token travels as ?token=) and then streams frames: binary JPEG messages, or text data URLs.
+    The offering gallery is held for the life of the connection. When inference falls behind,
+    only the newest frame is kept and older ones are dropped. Each processed frame produces one
+    JSON event: {"type": "match" | "no_match" | "no_face" | "bad_frame" | "low_quality" | "busy" | "error", ...}.
+    Once the session is ended elsewhere the socket sends {"type": "closed"} and closes.
+    """
+    from ..face_service import FaceQualityError, ImageDecodeError, extract_embedding, gallery_cache
+
+    try:
+        user = await run_in_threadpool(user_from_token, session, token)
+        attendance_session = await run_in_threadpool(_load_face_session, session, session_id, user)
+    except HTTPException as exc:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(exc.detail))
+        return
+    if not attendance_session.active:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Session is not active")
+        return
+
+    offering_id = attendance_session.offering_id
+    generation = gallery_cache.generation
+    gallery = await run_in_threadpool(get_offering_gallery, session, offering_id)
+    await websocket.accept()
+
+    latest: Optional[Union[bytes, str]] = None
+    dropped = 0
+    frame_ready = asyncio.Event()
+    connected = True
+
+    async def receive_frames() -> None:
+        nonlocal latest, dropped, connected
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                frame = message.get("bytes") or message.get("text")
+                if not frame:
+                    continue
+                if latest is not None:
+                    dropped += 1  # superseded before inference got to it
+                latest = frame
+                frame_ready.set()
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        finally:
+            connected = False
+            frame_ready.set()
+
+    receiver = asyncio.create_task(receive_frames())
+    try:
+        while True:
+            await frame_ready.wait()
+            frame_ready.clear()
+            if not connected:
+                break
+            frame, latest = latest, None
+            if frame is None:
+                continue
+
+            try:
+                probe = await inference_pool.run(extract_embedding, frame)
+            except InferenceBusyError:
+                await websocket.send_json({"type": "busy", "dropped": dropped})
+                continue
+            except FaceQualityError as exc:
+                await websocket.send_json(
+                    {"type": "low_quality", "reason": exc.reason, "detail": str(exc), "dropped": dropped}
+                )
+                continue
+            except ImageDecodeError as exc:
+                await websocket.send_json({"type": "bad_frame", "detail": str(exc), "dropped": dropped})
+                continue
+            except ValueError as exc:
+                await websocket.send_json({"type": "no_face", "detail": str(exc), "dropped": dropped})
+                continue
+            except Exception as exc:
+                await websocket.send_json({"type": "error", "detail": f"Error processing image: {str(exc)}"})
+                continue
+
+            if generation != gallery_cache.generation:
+                generation = gallery_cache.generation
+                gallery = await run_in_threadpool(get_offering_gallery, session, offering_id)
+
+            best_id, best_score = gallery.match(probe)
+            if not best_id or best_score < MATCH_THRESHOLD:
+                await websocket.send_json({"type": "no_match", "confidence": best_score, "dropped": dropped})
+                continue
+
+            # The connection's Session would otherwise keep serving the state it loaded at connect time
+            if not await run_in_threadpool(_session_still_active, session, attendance_session):
+                await websocket.send_json({"type": "closed", "detail": "Attendance session has ended"})
+                await websocket.close(code=status.WS_1000_NORMAL_CLOSURE, reason="Session ended")
+                break
+
+            label = attendance_presence.label(best_id)
+            if attendance_presence.needs_write(session_id, best_id) or label is None:
+                try:
+                    await run_in_threadpool(_mark_present, session, attendance_session, [(best_id, best_score)])
+                    label = (await run_in_threadpool(student_labels, session, [best_id]))[best_id]
+                except HTTPException as exc:
+                    await websocket.send_json({"type": "error", "detail": exc.detail})
+                    await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(exc.detail))
+                    break
+            student_id, student_name = label
+            await websocket.send_json(
+                {
+                    "type": "match",
+                    "student_id": student_id,
+                    "student_name": student_name,
+                    "confidence": best_score,
+                    "dropped": dropped,
+                }
+            )
+    except (WebSocketDisconnect, RuntimeError):
+        # Client went away mid-send
+        pass
+    finally:
+        receiver.cancel()
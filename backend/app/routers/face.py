@@ -1,24 +1,65 @@
-import json
-from typing import List
+import asyncio
+import os
+import re
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import FileResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlmodel import Session, select
 
 from ..auth import get_current_user
+from ..config import get_settings
+from ..crud import find_duplicate_face, get_institution_index, index_face_embedding, invalidate_face_galleries
 from ..database import get_session
-from ..face_service import extract_embedding, serialize_embeddings
-from ..models import FaceEmbedding, User, FaceUpdateRequest
-from ..schemas import FaceCaptureRequest, FaceEnrollmentStatus
+from ..image_store import face_image_store, verify_face_image_signature
+from ..inference import InferenceBusyError, inference_http_error, inference_pool, run_face_inference
+from ..models import FaceEmbedding, RoleEnum, StudentProfile, User, FaceUpdateRequest
+from ..schemas import (
+    FaceCaptureRequest,
+    FaceEnrollmentStatus,
+    FaceVerificationRequest,
+    IdentificationCandidate,
+    IdentificationResponse,
+)
+from ..uploads import image_upload_openapi, read_image_upload
+
+if TYPE_CHECKING:
+    import numpy as np
+
+    from ..face_service import ImagePayload
 
 router = APIRouter(prefix="/faces", tags=["Face"])
+settings = get_settings()
 
 
 @router.get("/model-info")
 def get_face_model_info(
     current_user: User = Depends(get_current_user),
 ):
-    from ..face_service import get_model_info
-    return {"model": get_model_info()}
+    from ..face_service import get_model_info, probe_cache, quality_stats
+    return {"model": get_model_info(), "probe_cache": probe_cache.stats(), "quality_rejects": quality_stats()}
+
+
+DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+@router.get("/images/{digest}/{variant}", include_in_schema=False)
+def get_face_image(digest: str, variant: str, exp: int = Query(...), sig: str = Query(...)):
+    """Face review previews, authorized by the signed, expiring URL from /admin/face-requests."""
+    if not DIGEST_PATTERN.match(digest) or not verify_face_image_signature(digest, variant, exp, sig):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+    path = face_image_store.path(digest, variant)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+    # Content-addressed, so a URL's bytes never change; caching stops when the URL expires
+    max_age = max(0, exp - int(time.time()))
+    return FileResponse(
+        path,
+        media_type="image/jpeg",
+        headers={"Cache-Control": f"private, max-age={max_age}, immutable", "ETag": f'"{digest}-{variant}"'},
+    )
 
 
 @router.get("/me", response_model=FaceEnrollmentStatus)
@@ -26,40 +67,96 @@ def get_enrollment_status(
     current_user: User = Depends(get_current_user),
     session: Session = Depends(get_session),
 ):
-    existing = session.exec(select(FaceEmbedding).where(FaceEmbedding.user_id == current_user.id)).first()
-    sample_count = 0
-    if existing and existing.vector:
-        try:
-            parsed = json.loads(existing.vector)
-            if isinstance(parsed, list) and parsed and isinstance(parsed[0], list):
-                sample_count = len(parsed)
-            elif isinstance(parsed, list):
-                sample_count = 1
-            else:
-                sample_count = 1
-        except json.JSONDecodeError:
-            sample_count = 0
+    sample_count = session.exec(
+        select(FaceEmbedding.sample_count).where(FaceEmbedding.user_id == current_user.id)
+    ).first() or 0
     return FaceEnrollmentStatus(enrolled=sample_count >= 3, samples=sample_count)
 
 
-@router.post("/capture")
-def capture_face(
-    payload: FaceCaptureRequest,
+@router.post("/capture", openapi_extra=image_upload_openapi(FaceCaptureRequest, "images"))
+async def capture_face(
+    request: Request,
     current_user: User = Depends(get_current_user),
     session: Session = Depends(get_session),
 ):
-    images: List[str] = []
-    if payload.images:
+    payload, raw_images = await read_image_upload(request, FaceCaptureRequest, settings.face_capture_max_images)
+    images: List[ImagePayload] = []
+    if raw_images:
+        images = raw_images
+    elif payload.images:
         images = payload.images
     elif payload.image_data:
         images = [payload.image_data]
     else:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Provide at least one image")
+    if len(images) > settings.face_capture_max_images:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.face_capture_max_images} images per capture",
+        )
 
+    if payload.faces is not None and len(payload.faces) != len(images):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Provide one face hint per image")
+
+    samples = await _collect_enrollment_samples(images, payload.faces, payload.aligned)
+    # Only the kept frames reach SFace, in one batched forward pass
+    from ..face_service import embed_aligned_faces
+
+    embeddings = await run_face_inference(embed_aligned_faces, [crop for _, _, crop in samples])
+    preview = images[samples[0][1]]
+    return await run_in_threadpool(_store_enrollment, session, current_user, preview, embeddings)
+
+
+async def _collect_enrollment_samples(
+    images: List["ImagePayload"], hints: Optional[Sequence[Sequence[float]]], aligned: bool
+) -> List[Tuple[float, int, "np.ndarray"]]:
+    """
+    Detect, gate and align a burst of frames on the inference pool, up to one frame per
+    worker at a time, and stop as soon as face_enroll_early_stop frames have passed.
+    Unusable frames are skipped. Returns the best face_enroll_samples as
+    (quality, image index, aligned crop), best first.
+    """
+    from ..face_service import prepare_enrollment_sample
+
+    accepted: List[Tuple[float, int, "np.ndarray"]] = []
+    pending: Dict[asyncio.Future, int] = {}
+    last_error: Optional[Exception] = None
+    next_index = 0
     try:
-        embeddings = [extract_embedding(image) for image in images]
-    except ValueError as exc:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+        while len(accepted) < settings.face_enroll_early_stop and (pending or next_index < len(images)):
+            while next_index < len(images) and len(pending) < inference_pool.workers:
+                hint = hints[next_index] if hints is not None else None
+                try:
+                    job = inference_pool.submit(prepare_enrollment_sample, images[next_index], hint, aligned)
+                except InferenceBusyError as exc:
+                    if not pending:
+                        raise inference_http_error(exc) from exc
+                    break  # the pool is shared; wait for one of ours to finish before submitting more
+                pending[asyncio.wrap_future(job)] = next_index
+                next_index += 1
+
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    quality, crop = future.result()
+                except Exception as exc:
+                    last_error = exc
+                    continue
+                accepted.append((quality, index, crop))
+    finally:
+        # Early stop (or a failure): frames still queued are dropped, running ones just finish
+        for future in pending:
+            future.cancel()
+
+    if not accepted:
+        raise inference_http_error(last_error or ValueError("No usable face in the captured images"))
+    accepted.sort(key=lambda sample: sample[0], reverse=True)
+    return accepted[: settings.face_enroll_samples]
+
+
+def _store_enrollment(session: Session, current_user: User, preview: "ImagePayload", embeddings: "np.ndarray") -> dict:
+    from ..face_service import MODEL_VERSION, pack_embeddings
 
     existing = session.exec(select(FaceEmbedding).where(FaceEmbedding.user_id == current_user.id)).first()
     
@@ -72,31 +169,109 @@ def capture_face(
     if pending:
          raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="You already have a pending face update request.")
 
-    if existing:
-        # User already has a face enrolled. Create an update request.
+    # A face that looks like another user's never goes live without an admin seeing the match
+    duplicate_user_id, duplicate_score = find_duplicate_face(session, current_user.id, pack_embeddings(embeddings))
+
+    if existing or duplicate_user_id is not None:
+        # User already has a face enrolled (or this one is a likely duplicate). Create an update request.
         # We'll use the new embeddings. For simplicity, we replace the old ones in the request.
         # In a real scenario, you might want to merge or select best. 
         # Here we just take the new ones as the proposed "new face".
-        new_vector = serialize_embeddings(embeddings[:3])
+        samples = embeddings
         
-        # Use the first image as the preview for admin
-        preview_image = images[0] if images else ""
+        # Use the best-quality frame as the preview for admin; it goes to the image store, not the DB
+        try:
+            preview_digest = face_image_store.put(preview)
+        except ValueError:
+            preview_digest = None  # e.g. an aligned crop the thumbnailer can't read; review without preview
         
         request = FaceUpdateRequest(
             user_id=current_user.id,
-            vector=new_vector,
-            image_data=preview_image,
-            status="PENDING"
+            embedding=pack_embeddings(samples),
+            sample_count=len(samples),
+            model_version=MODEL_VERSION,
+            image_digest=preview_digest,
+            status="PENDING",
+            duplicate_user_id=duplicate_user_id,
+            duplicate_score=duplicate_score,
         )
         session.add(request)
         session.commit()
+        if not existing:
+            return {"message": "Face resembles another enrolled user and was sent for admin approval.", "samples": 0, "status": "PENDING"}
         return {"message": "Face update request submitted for approval.", "samples": 0, "status": "PENDING"}
     else:
         # First time enrollment - Auto approve
-        stored = serialize_embeddings(embeddings[:3])
-        session.add(FaceEmbedding(user_id=current_user.id, vector=stored))
-        sample_count = min(3, len(embeddings))
+        samples = embeddings
+        session.add(
+            FaceEmbedding(
+                user_id=current_user.id,
+                embedding=pack_embeddings(samples),
+                sample_count=len(samples),
+                model_version=MODEL_VERSION,
+            )
+        )
+        sample_count = len(samples)
         session.commit()
+        invalidate_face_galleries()
+        index_face_embedding(session)
         return {"message": f"Stored {sample_count} face sample(s)", "samples": sample_count, "status": "APPROVED"}
 
 
+
+
+@router.post(
+    "/identify",
+    response_model=IdentificationResponse,
+    openapi_extra=image_upload_openapi(FaceVerificationRequest, "image"),
+)
+async def identify_face(
+    request: Request,
+    limit: int = Query(5, ge=1, le=20),
+    min_confidence: float = Query(0.50, ge=-1.0, le=1.0),
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    """Walk-in identification: search the face in the image against every enrolled user."""
+    if current_user.role not in (RoleEnum.TEACHER, RoleEnum.ADMIN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Face identification restricted")
+
+    payload, raw_images = await read_image_upload(request, FaceVerificationRequest)
+    image = raw_images[0] if raw_images else payload.image_data
+    if not image:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Provide an image")
+
+    from ..face_service import extract_embedding
+
+    probe = await run_face_inference(extract_embedding, image, payload.face, payload.aligned)
+    return await run_in_threadpool(_identify, session, probe, limit, min_confidence)
+
+
+def _identify(session: Session, probe: "np.ndarray", limit: int, min_confidence: float) -> IdentificationResponse:
+    hits = [(user_id, score) for user_id, score in get_institution_index(session).search(probe, k=limit) if score >= min_confidence]
+    if not hits:
+        return IdentificationResponse(matched=False, candidates=[], message="No enrolled face matched")
+
+    scores = dict(hits)
+    rows = session.exec(
+        select(User, StudentProfile.student_id)
+        .join(StudentProfile, StudentProfile.user_id == User.id, isouter=True)
+        .where(User.id.in_(list(scores)))
+    ).all()
+    candidates = [
+        IdentificationCandidate(
+            user_id=user.id,
+            full_name=user.full_name,
+            email=user.email,
+            role=user.role,
+            student_id=student_code,
+            confidence=scores[user.id],
+        )
+        for user, student_code in rows
+    ]
+    candidates.sort(key=lambda candidate: candidate.confidence, reverse=True)
+    return IdentificationResponse(
+        matched=True,
+        candidates=candidates,
+        message=f"Best match: {candidates[0].full_name}" if candidates else "No enrolled face matched",
+    )
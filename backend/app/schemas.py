@@ -1,7 +1,8 @@
+import json
 from datetime import datetime
 from typing import List, Optional
 
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, field_validator
 
 from .models import AttendanceStatus, CourseRequestStatus, RoleEnum
 
@@ -170,9 +171,20 @@ class AttendanceRecordResponse(BaseModel):
     confidence: Optional[float]
 
 
+def _json_list(value):
+    # Form fields and query parameters carry face hints as JSON text
+    if isinstance(value, str):
+        return json.loads(value) if value.strip() else None
+    return value
+
+
 class FaceCaptureRequest(BaseModel):
     image_data: Optional[str] = None  # single capture fallback
     images: List[str] = []  # batch capture payload
+    faces: Optional[List[List[float]]] = None  # client-detected face per image, see FaceVerificationRequest.face
+    aligned: bool = False  # images are already 112x112 aligned crops
+
+    _parse_faces = field_validator("faces", mode="before")(_json_list)
 
 
 class FaceEnrollmentStatus(BaseModel):
@@ -181,7 +193,13 @@ class FaceEnrollmentStatus(BaseModel):
 
 
 class FaceVerificationRequest(BaseModel):
-    image_data: str
+    image_data: Optional[str] = None  # base64 data URL; binary uploads send the image as the body instead
+    # Optional client-side detection: x, y, w, h then the five (x, y) landmarks in YuNet order
+    # (right eye, left eye, nose tip, right and left mouth corner), in image pixels
+    face: Optional[List[float]] = None
+    aligned: bool = False  # image is already a 112x112 aligned crop; skips detection and alignment
+
+    _parse_face = field_validator("face", mode="before")(_json_list)
 
 
 class FaceVerificationResponse(BaseModel):
@@ -194,6 +212,63 @@ class FaceVerificationResponse(BaseModel):
     matched_embedding: Optional[str] = None  # The embedding that was matched (if any)
 
 
+class ClassroomRecognitionRequest(BaseModel):
+    # Faces are detected server-side in a classroom photo, so per-face hints are rejected, not ignored
+    model_config = ConfigDict(extra="forbid")
+
+    image_data: Optional[str] = None  # base64 data URL; binary uploads send the image as the body instead
+
+
+class ClassroomMatch(BaseModel):
+    student_id: str
+    student_name: str
+    confidence: float
+    box: List[float]  # x, y, width, height of the face in the submitted frame
+
+
+class ClassroomRecognitionResponse(BaseModel):
+    faces_detected: int
+    matches: List[ClassroomMatch]
+    unmatched_boxes: List[List[float]] = []
+    message: str
+
+
+class IdentificationCandidate(BaseModel):
+    user_id: int
+    full_name: str
+    email: str
+    role: RoleEnum
+    student_id: Optional[str] = None
+    confidence: float
+
+
+class IdentificationResponse(BaseModel):
+    matched: bool
+    candidates: List[IdentificationCandidate]
+    message: str
+
+
+class FaceReviewItem(BaseModel):
+    id: int
+    user_id: int
+    user_name: str
+    user_email: str
+    thumbnail_url: Optional[str] = None
+    image_url: Optional[str] = None
+    created_at: datetime
+    duplicate_user_id: Optional[int] = None
+    duplicate_user_name: Optional[str] = None
+    duplicate_user_email: Optional[str] = None
+    duplicate_score: Optional[float] = None
+
+
+class FaceReviewPage(BaseModel):
+    items: List[FaceReviewItem]
+    total: int
+    page: int
+    page_size: int
+
+
 class DashboardSummary(BaseModel):
     total_users: int
     total_teachers: int
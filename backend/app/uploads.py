@@ -0,0 +1,146 @@
+from typing import AsyncIterator, List, Tuple, Type, TypeVar, Union
+
+from fastapi import HTTPException, Request, status
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError
+from starlette.datastructures import UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
+
+from .config import get_settings
+
+M = TypeVar("M", bound=BaseModel)
+
+settings = get_settings()
+
+RAW_IMAGE_CONTENT_TYPES = ("application/octet-stream", "image/jpeg", "image/png")
+
+# Leeway for the JSON envelope and the "data:image/jpeg;base64," prefix
+JSON_OVERHEAD_BYTES = 16 * 1024
+
+
+def _validation_error(exc: ValidationError, location: str = "body") -> RequestValidationError:
+    # Same shape FastAPI produces for a regular body parameter
+    errors = exc.errors(include_url=False, include_input=False)
+    return RequestValidationError([{**error, "loc": (location, *error["loc"])} for error in errors])
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Image payload exceeds {settings.face_max_image_bytes} bytes per image",
+    )
+
+
+async def _limited_stream(request: Request, limit: int) -> AsyncIterator[bytes]:
+    """The request body's chunks, giving up as soon as it exceeds `limit` bytes, declared or not (chunked)."""
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > limit:
+        raise _too_large()
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > limit:
+            raise _too_large()
+        yield chunk
+
+
+async def _read_body(request: Request, limit: int) -> bytearray:
+    body = bytearray()
+    async for chunk in _limited_stream(request, limit):
+        body += chunk
+    return body
+
+
+def _check_json_images(payload: BaseModel) -> None:
+    """Apply the per-image limit to base64 images in a JSON body, which is otherwise only capped as a whole."""
+    images = list(getattr(payload, "images", None) or [])
+    if getattr(payload, "image_data", None):
+        images.append(payload.image_data)
+    for image in images:
+        encoded = image.split(",", 1)[1] if "," in image else image
+        if len(encoded) * 3 // 4 > settings.face_max_image_bytes:
+            raise _too_large()
+
+
+async def read_image_upload(
+    request: Request, json_model: Type[M], max_images: int = 1
+) -> Tuple[M, List[Union[bytes, bytearray]]]:
+    """
+    Accept a face image in any of three encodings:
+
+    * application/json - the original `json_model` body with base64 data URLs
+    * multipart/form-data - one or more file parts; other form fields fill `json_model`
+    * application/octet-stream (or image/jpeg, image/png) - the raw image as the whole body;
+      other fields of `json_model` come from the query string
+
+    Returns the parsed model plus the raw image bytes (empty for JSON requests). Binary images
+    are handed to the decoder as-is, skipping the base64 inflation and the large pydantic string.
+    """
+    content_type = request.headers.get("content-type", "").split(";", 1)[0].strip().lower()
+    limit = settings.face_max_image_bytes * max_images
+
+    if content_type in RAW_IMAGE_CONTENT_TYPES:
+        body = await _read_body(request, settings.face_max_image_bytes)
+        # The body is the image itself, so any other fields travel as query parameters
+        try:
+            return json_model.model_validate(dict(request.query_params)), [body] if body else []
+        except ValidationError as exc:
+            raise _validation_error(exc, "query") from exc
+
+    if content_type == "multipart/form-data":
+        # Parsed from a capped stream, so the parser never spools more than the limit
+        parser = MultiPartParser(
+            request.headers, _limited_stream(request, limit + JSON_OVERHEAD_BYTES), max_files=max_images
+        )
+        try:
+            form = await parser.parse()
+        except MultiPartException as exc:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=exc.message) from exc
+        images: List[Union[bytes, bytearray]] = []
+        fields = {}
+        try:
+            for key, value in form.multi_items():
+                if isinstance(value, UploadFile):
+                    data = await value.read()
+                    if len(data) > settings.face_max_image_bytes:
+                        raise _too_large()
+                    if data:
+                        images.append(data)
+                else:
+                    fields[key] = value
+        finally:
+            await form.close()
+        try:
+            return json_model.model_validate(fields), images
+        except ValidationError as exc:
+            raise _validation_error(exc) from exc
+
+    # Base64 inflates the payload by a third
+    body = await _read_body(request, limit * 4 // 3 + JSON_OVERHEAD_BYTES)
+    try:
+        payload = json_model.model_validate_json(body or b"{}")
+    except ValidationError as exc:
+        raise _validation_error(exc) from exc
+    _check_json_images(payload)
+    return payload, []
+
+
+def image_upload_openapi(json_model: Type[BaseModel], file_field: str) -> dict:
+    """openapi_extra documenting the three request encodings accepted by read_image_upload."""
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": json_model.model_json_schema()},
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            file_field: {"type": "array", "items": {"type": "string", "format": "binary"}},
+                        },
+                    }
+                },
+                "application/octet-stream": {"schema": {"type": "string", "format": "binary"}},
+            },
+        }
+    }
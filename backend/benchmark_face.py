@@ -0,0 +1,305 @@
+"""
+Micro-benchmarks for the face pipeline in app.face_service.
+
+Runs against deterministic stub detector/recognition backends by default, so it
+works without the ONNX files, and additionally against the real YuNet/SFace models when
+they are present in backend/models. Results are printed as a table and can be written
+as JSON (--output) and compared against a previous run (--compare) to catch regressions
+in the verify path before deploy. Quantized (float16/int8) galleries are also checked for
+accuracy against exact float32 cosine similarity.
+
+    python benchmark_face.py --output bench.json
+    python benchmark_face.py --compare bench.json --tolerance 0.25
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import face_service  # noqa: E402
+from app.face_index import FaceIndex  # noqa: E402
+from app.quantization import normalize_rows  # noqa: E402
+
+RESOLUTIONS = [(640, 480), (1280, 720), (1920, 1080)]
+GALLERY_SIZES = [10, 100, 1000, 10_000, 100_000]
+QUANTIZED = [("float16", 0), ("float16", 32), ("int8", 0), ("int8", 32)]  # (precision, rerank)
+
+def synthetic_face_row(width, height):
+    """A YuNet-style row for a centred frontal face covering ~40% of the shorter side."""
+    size = 0.4 * min(width, height)
+    x, y = (width - size) / 2, (height - size) / 2
+    landmarks = face_service.ALIGN_TEMPLATE / face_service.ALIGNED_SIZE * size + np.array([x, y], dtype=np.float32)
+    return np.concatenate([[x, y, size, size], landmarks.ravel(), [0.95]]).astype(np.float32)
+
+
+def synthetic_image(width, height, seed=0):
+    """Deterministic textured frame with a face-like blob where synthetic_face_row puts the face."""
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(0, 255, (height // 8 + 1, width // 8 + 1, 3), dtype=np.uint8)
+    image = cv2.resize(noise, (width, height), interpolation=cv2.INTER_LINEAR)
+    face = synthetic_face_row(width, height)
+    x, y, size = face[0], face[1], face[2]
+    center = (int(x + size / 2), int(y + size / 2))
+    cv2.ellipse(image, center, (int(size * 0.4), int(size * 0.5)), 0, 0, 360, (150, 170, 200), -1)
+    for lx, ly in face[4:14].reshape(5, 2):
+        cv2.circle(image, (int(lx), int(ly)), max(2, int(size * 0.04)), (40, 40, 60), -1)
+    return image
+
+
+class StubDetector:
+    """Stands in for cv2.FaceDetectorYN: one centred face, with a per-pixel pass so cost scales with resolution."""
+
+    def setInputSize(self, size):
+        self.size = size
+
+    def detect(self, image):
+        cv2.GaussianBlur(image, (5, 5), 0)
+        height, width = image.shape[:2]
+        return 1, synthetic_face_row(width, height)[None, :]
+
+
+# Fixed projection of a coarse 16x8 thumbnail: deterministic and cheap, 128 dims like SFace
+STUB_PROJECTION = np.random.default_rng(42).standard_normal((128, face_service.EMBEDDING_DIM)).astype(np.float32)
+
+
+def _stub_features(gray_crops):
+    thumbs = np.stack([cv2.resize(crop, (8, 16), interpolation=cv2.INTER_AREA).ravel() for crop in gray_crops])
+    return thumbs.astype(np.float32) @ STUB_PROJECTION
+
+
+class StubBackend:
+    """Stands in for the RecognitionBackend used by embed_aligned_faces."""
+
+    name = "stub"
+
+    def embed(self, crops):
+        return _stub_features([crop.astype(np.float32).mean(axis=2) for crop in crops])
+
+
+def measure(fn, repeat, budget_seconds):
+    """Per-call timings in microseconds: one warm-up call, then up to `repeat` calls within the time budget."""
+    start = time.perf_counter_ns()
+    fn()
+    warm_up = (time.perf_counter_ns() - start) / 1000
+    # A case slower than the whole budget is timed by its warm-up call alone
+    timings = [warm_up] if warm_up > budget_seconds * 1e6 else []
+    deadline = time.perf_counter() + budget_seconds
+    while len(timings) < repeat and (not timings or time.perf_counter() < deadline):
+        start = time.perf_counter_ns()
+        fn()
+        timings.append((time.perf_counter_ns() - start) / 1000)
+    timings = np.array(timings)
+    return {
+        "runs": len(timings),
+        "median_us": round(float(np.median(timings)), 2),
+        "p95_us": round(float(np.percentile(timings, 95)), 2),
+        "mean_us": round(float(timings.mean()), 2),
+    }
+
+
+ORIGINAL_GETTERS = (
+    face_service._get_face_detector,
+    face_service._get_recognition_backend,
+)
+
+
+def _install(models):
+    if models == "stub":
+        face_service._get_face_detector = StubDetector
+        face_service._get_recognition_backend = StubBackend
+    else:
+        face_service._get_face_detector = ORIGINAL_GETTERS[0]
+        face_service._get_recognition_backend = ORIGINAL_GETTERS[1]
+
+
+def pipeline_cases(models, image_path):
+    """(name, params, callable) for decode, detection, alignment and feature extraction."""
+    cases = []
+    for width, height in RESOLUTIONS:
+        image = synthetic_image(width, height)
+        jpeg = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+        data_url = "data:image/jpeg;base64," + base64.b64encode(jpeg).decode("ascii")
+        params = {"resolution": f"{width}x{height}", "bytes": len(jpeg)}
+        cases.append(("decode_image_base64", params, lambda d=data_url: face_service._decode_image(d)))
+        cases.append(("decode_image_raw", params, lambda d=jpeg: face_service._decode_image(d)))
+        cases.append(("detect_faces", params, lambda i=image: _detect_or_none(i)))
+        if models == "stub":
+            cases.append(("extract_embedding", params, lambda d=jpeg: face_service.extract_embedding(d)))
+
+    if image_path:
+        with open(image_path, "rb") as handle:
+            photo = handle.read()
+        cases.append(("extract_embedding", {"image": os.path.basename(image_path)}, lambda: face_service.extract_embedding(photo)))
+
+    image = synthetic_image(640, 480)
+    face = synthetic_face_row(640, 480)
+    backend = face_service._get_recognition_backend()
+    crop = face_service.align_face(image, face)
+    cases.append(("align_crop", {}, lambda: face_service.align_face(image, face)))
+    cases.append(("feature", {}, lambda: backend.embed([crop])))
+    cases.append(("embed_aligned_faces", {"batch": 3}, lambda: face_service.embed_aligned_faces([crop] * 3)))
+    return cases
+
+
+def _detect_or_none(image):
+    try:
+        return face_service._detect_faces(image)
+    except ValueError:
+        return None  # real YuNet finds no face in synthetic frames; the cost is what matters
+
+
+def matching_cases(gallery_sizes):
+    """Stored-blob decoding and the vectorized gallery/index paths over galleries of increasing size."""
+    rng = np.random.default_rng(7)
+    samples = normalize_rows(rng.standard_normal((3, face_service.EMBEDDING_DIM)).astype(np.float32))
+    blob = face_service.pack_embeddings(samples)
+    probe = samples[0]
+    cases = [
+        ("embedding_templates", {"samples": 3}, lambda: face_service.embedding_templates(blob)),
+    ]
+    for size in gallery_sizes:
+        vectors = normalize_rows(rng.standard_normal((size, face_service.EMBEDDING_DIM)).astype(np.float32))
+        gallery = face_service.FaceGallery(list(range(size)), list(vectors))
+        index = FaceIndex(face_service.EMBEDDING_DIM)
+        index.build([(owner, vector[None, :]) for owner, vector in enumerate(vectors)])
+        params = {"gallery": size}
+        cases.append(("gallery_match", params, lambda g=gallery: g.match(probe)))
+        for precision, rerank in QUANTIZED:
+            quantized = face_service.FaceGallery(list(range(size)), list(vectors), precision=precision, rerank=rerank)
+            quantized_params = {**params, "precision": precision, "rerank": rerank}
+            cases.append(("gallery_match", quantized_params, lambda g=quantized: g.match(probe)))
+        cases.append(("index_search", {**params, "exact": index.is_exact}, lambda i=index: i.search(probe, k=5)))
+    return cases
+
+
+def quantization_accuracy(gallery_sizes, queries=200):
+    """
+    Quantized galleries against exact float32: memory, how often the top-1 student agrees with
+    a float32 gallery, and how far the reported score is from the exact cosine similarity on the
+    matched template. Probes are noisy re-captures of enrolled faces, like a real verify.
+    Re-ranking scores dequantized rows, so the delta includes the storage loss either way.
+    """
+    rng = np.random.default_rng(11)
+    rows = []
+    for size in gallery_sizes:
+        vectors = normalize_rows(rng.standard_normal((size, face_service.EMBEDDING_DIM)).astype(np.float32))
+        picks = rng.integers(0, size, queries)
+        noise = rng.normal(0, 0.04, (queries, face_service.EMBEDDING_DIM)).astype(np.float32)
+        probes = normalize_rows(vectors[picks] + noise)
+        reference = face_service.FaceGallery(list(range(size)), list(vectors))
+        expected = [reference.match(probe)[0] for probe in probes]
+        for precision, rerank in QUANTIZED:
+            gallery = face_service.FaceGallery(list(range(size)), list(vectors), precision=precision, rerank=rerank)
+            agree, deltas = 0, []
+            for probe, want in zip(probes, expected):
+                student_id, score = gallery.match(probe)
+                agree += student_id == want
+                exact = float(vectors[student_id] @ probe)  # both unit-length
+                deltas.append(abs(score - exact))
+            row = {
+                "gallery": size,
+                "precision": precision,
+                "rerank": rerank,
+                "bytes": gallery.matrix.nbytes,
+                "memory_ratio": round(reference.matrix.nbytes / gallery.matrix.nbytes, 2),
+                "top1_agreement": agree / queries,
+                "mean_abs_delta": float(np.mean(deltas)),
+                "max_abs_delta": float(np.max(deltas)),
+            }
+            rows.append(row)
+            print(
+                f"accuracy gallery={size:<7} {precision:7} rerank={rerank:<3} memory 1/{row['memory_ratio']:<5} "
+                f"top-1 {row['top1_agreement']:.3f}   |delta| mean {row['mean_abs_delta']:.2e} max {row['max_abs_delta']:.2e}"
+            )
+    print("accuracy |delta| is against the original float32 templates, so it includes the float16/int8 storage loss")
+    return rows
+
+
+def run(args):
+    models_present = os.path.exists(face_service.YUNET_PATH) and os.path.exists(face_service.ARCFACE_PATH)
+    model_sets = ["stub"] + (["real"] if models_present and not args.stub_only else [])
+    # Every call must do the full work; a cache hit would measure a dictionary lookup
+    face_service.probe_cache.max_entries = 0
+
+    results = []
+
+    def record(models, name, params, fn):
+        stats = measure(fn, args.repeat, args.budget)
+        results.append({"name": name, "models": models, "params": params, **stats})
+        label = ", ".join(f"{key}={value}" for key, value in params.items())
+        print(f"{models:5} {name:24} {label:38} median {stats['median_us']:>12.1f} us   p95 {stats['p95_us']:>12.1f} us")
+
+    for models in model_sets:
+        _install(models)
+        for name, params, fn in pipeline_cases(models, args.image):
+            record(models, name, params, fn)
+    _install("stub")
+    for name, params, fn in matching_cases(args.gallery_sizes):
+        record("-", name, params, fn)
+    accuracy = quantization_accuracy(args.gallery_sizes)
+
+    return {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "cpu_count": os.cpu_count(),
+            "machine": platform.machine(),
+            "models": model_sets,
+            "backend": face_service.settings.face_inference_backend,
+        },
+        "results": results,
+        "accuracy": accuracy,
+    }
+
+
+def _result_key(result):
+    return (result["name"], result["models"], json.dumps(result["params"], sort_keys=True))
+
+
+def compare(report, baseline_path, tolerance):
+    """Print cases whose median got slower than the baseline by more than `tolerance`; returns their count."""
+    with open(baseline_path) as handle:
+        baseline = {_result_key(result): result for result in json.load(handle)["results"]}
+    regressions = 0
+    for result in report["results"]:
+        previous = baseline.get(_result_key(result))
+        if not previous or previous["median_us"] <= 0:
+            continue
+        ratio = result["median_us"] / previous["median_us"]
+        if ratio > 1 + tolerance:
+            regressions += 1
+            print(f"REGRESSION {result['name']} {result['params']}: {previous['median_us']:.1f} -> {result['median_us']:.1f} us ({ratio:.2f}x)")
+    print(f"{regressions} regression(s) against {baseline_path}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the face recognition pipeline")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed median slowdown vs baseline (0.25 = 25%%)")
+    parser.add_argument("--repeat", type=int, default=50, help="timed calls per case")
+    parser.add_argument("--budget", type=float, default=2.0, help="seconds per case before stopping early")
+    parser.add_argument("--gallery-sizes", type=int, nargs="+", default=GALLERY_SIZES)
+    parser.add_argument("--image", help="real face photo for end-to-end extract_embedding timings")
+    parser.add_argument("--stub-only", action="store_true", help="skip the real models even if present")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(report, handle, indent=2)
+        print(f"Wrote {len(report['results'])} result(s) to {args.output}")
+    if args.compare and compare(report, args.compare, args.tolerance):
+        sys.exit(1)
@@ -0,0 +1,94 @@
+"""
+Parity check between the face recognition runtimes in app.inference_backends.
+
+Embeds the same aligned crops with every backend and compares the unit-length embeddings
+against the first (reference) backend, and each backend's batched output against its own
+single-crop output, row by row. If any row differs by more than --tolerance the runtimes
+are not interchangeable for stored templates and the script exits 1. Timings are printed
+too, to help pick the faster runtime for a host (settings.face_inference_backend).
+tests/test_backend_parity.py makes the same comparisons (plus align_face against OpenCV's
+alignCrop) as unit tests, skipped when the models are absent.
+
+    python check_backend_parity.py
+    python check_backend_parity.py --image student.jpg --backends opencv onnxruntime
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import face_service  # noqa: E402
+from app.inference_backends import BACKENDS, create_recognition_backend  # noqa: E402
+from app.quantization import normalize_rows  # noqa: E402
+from benchmark_face import measure, synthetic_face_row, synthetic_image  # noqa: E402
+
+
+def load_crops(image_paths, count):
+    """Aligned crops from real photos when given, else from deterministic synthetic frames."""
+    if image_paths:
+        crops = []
+        for path in image_paths:
+            with open(path, "rb") as handle:
+                crops.append(face_service._align_best_face(face_service._payload_buffer(handle.read()))[1])
+        return crops
+    return [face_service.align_face(synthetic_image(640, 480, seed), synthetic_face_row(640, 480)) for seed in range(count)]
+
+
+def compare(label, expected, actual, tolerance):
+    """Print how far two embedding matrices are apart, row by row; returns True when every row is within tolerance."""
+    if expected.shape != actual.shape:
+        print(f"  {label:34} shape {actual.shape} != {expected.shape}   MISMATCH")
+        return False
+    row_diffs = np.abs(expected - actual).max(axis=1)
+    worst = int(np.argmax(row_diffs))
+    min_cosine = float(np.min(np.sum(expected * actual, axis=1)))
+    bad_rows = np.flatnonzero(row_diffs > tolerance)
+    status = "OK" if not len(bad_rows) else f"MISMATCH in rows {', '.join(map(str, bad_rows[:10]))}"
+    print(f"  {label:34} max |diff| {row_diffs[worst]:.2e} (row {worst})   min cosine {min_cosine:.6f}   {status}")
+    return not len(bad_rows)
+
+
+def run(args):
+    if not os.path.exists(face_service.ARCFACE_PATH) or not os.path.exists(face_service.YUNET_PATH):
+        print(f"Models not found in {face_service.MODELS_DIR}")
+        return 2
+    crops = load_crops(args.image, args.crops)
+    print(f"{len(crops)} aligned crop(s), tolerance {args.tolerance}")
+
+    failures = 0
+    reference = None
+    for name in args.backends:
+        try:
+            backend = create_recognition_backend(name, face_service.ARCFACE_PATH)
+        except RuntimeError as exc:
+            print(f"{name}: skipped ({exc})")
+            continue
+        batched = normalize_rows(backend.embed(crops).astype(np.float32))
+        single = normalize_rows(np.vstack([backend.embed([crop]) for crop in crops]).astype(np.float32))
+        stats = measure(lambda: backend.embed(crops), args.repeat, args.budget)
+        print(f"{name}: median {stats['median_us'] / 1000:.2f} ms per batch of {len(crops)}, p95 {stats['p95_us'] / 1000:.2f} ms")
+        failures += not compare("batched vs single crop", single, batched, args.tolerance)
+        if reference is None:
+            reference = (name, batched)
+        else:
+            failures += not compare(f"vs {reference[0]}", reference[1], batched, args.tolerance)
+
+    if reference is None:
+        print("No backend could be loaded")
+        return 2
+    print(f"{failures} mismatch(es)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that face recognition backends produce matching embeddings")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--image", nargs="*", help="face photos to align and embed instead of synthetic frames")
+    parser.add_argument("--crops", type=int, default=8, help="synthetic crops when no --image is given")
+    parser.add_argument("--tolerance", type=float, default=1e-3, help="largest allowed element difference between unit-length embeddings")
+    parser.add_argument("--repeat", type=int, default=20, help="timed calls per backend")
+    parser.add_argument("--budget", type=float, default=2.0, help="seconds of timing per backend")
+    sys.exit(run(parser.parse_args()))
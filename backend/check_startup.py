@@ -0,0 +1,80 @@
+"""
+Cold-start budget check for the API.
+
+Starts a fresh interpreter per run, imports app.main and runs the startup hook (database
+init and curriculum seeding) against an empty scratch database, then reports the median.
+It fails (exit 1) when the median exceeds --budget-ms, or when OpenCV or NumPy were
+imported: those belong to the first face request (or settings.face_warm_up_on_startup).
+
+    python check_startup.py
+    python check_startup.py --runs 7 --budget-ms 2500
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Runs in the child interpreter; prints one JSON line
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+app.main.on_startup()
+started = time.perf_counter()
+app.main.on_startup()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "startup_ms": (started - imported) * 1000,
+    "reseed_ms": (time.perf_counter() - started) * 1000,
+    "heavy_modules": [name for name in ("cv2", "numpy", "app.face_service") if name in sys.modules],
+}))
+"""
+
+
+def cold_start(scratch_dir, run):
+    env = dict(os.environ)
+    env.update(
+        DATABASE_URL=f"sqlite:///{os.path.join(scratch_dir, f'startup_{run}.db')}",
+        CREDENTIALS_DATABASE_URL=f"sqlite:///{os.path.join(scratch_dir, f'credentials_{run}.db')}",
+        FACE_IMAGE_STORE_DIR=os.path.join(scratch_dir, "face_images"),
+        FACE_GALLERY_DIR=os.path.join(scratch_dir, "face_galleries"),
+        FACE_WARM_UP_ON_STARTUP="false",
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        samples = [cold_start(scratch_dir, run) for run in range(args.runs)]
+
+    for key in ("import_ms", "startup_ms", "reseed_ms"):
+        values = [sample[key] for sample in samples]
+        print(f"{key:12} median {statistics.median(values):8.1f} ms   max {max(values):8.1f} ms")
+    total = statistics.median(sample["import_ms"] + sample["startup_ms"] for sample in samples)
+    print(f"{'total':12} median {total:8.1f} ms   budget {args.budget_ms:.0f} ms")
+
+    failures = 0
+    heavy = sorted({name for sample in samples for name in sample["heavy_modules"]})
+    if heavy:
+        print(f"FAIL: imported at startup: {', '.join(heavy)}")
+        failures += 1
+    if total > args.budget_ms:
+        print("FAIL: over the startup budget")
+        failures += 1
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure API cold start against a time budget")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to start")
+    parser.add_argument("--budget-ms", type=float, default=3000, help="largest allowed median import + startup time")
+    sys.exit(run(parser.parse_args()))
@@ -1,34 +1,195 @@
+import argparse
 import sqlite3
+import sys
 from pathlib import Path
 
 ROOT = Path(__file__).resolve().parent
 DB_PATH = ROOT / "attendance.db"
 
-def migrate():
+# Rows converted per transaction. Each batch commits on its own, so an interrupted
+# run simply picks up the remaining unconverted rows next time.
+DEFAULT_BATCH_SIZE = 500
+
+FACE_TABLES = ("faceembedding", "faceupdaterequest")
+
+
+class MigrationError(Exception):
+    pass
+
+
+def _columns(cursor, table):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [info[1] for info in cursor.fetchall()]
+
+
+def migrate_session_number(conn):
+    cursor = conn.cursor()
+    columns = _columns(cursor, "attendancesession")
+
+    if "session_number" not in columns:
+        print("Adding session_number column...")
+        cursor.execute("ALTER TABLE attendancesession ADD COLUMN session_number INTEGER DEFAULT 1 NOT NULL")
+        conn.commit()
+        print("Migration successful.")
+    else:
+        print("Column session_number already exists.")
+
+
+def migrate_face_vectors(conn, table, batch_size=DEFAULT_BATCH_SIZE):
+    """Convert JSON `vector` text into the packed float32 `embedding` blob, then drop `vector`."""
+    sys.path.append(str(ROOT))
+    from app.face_service import MODEL_VERSION, pack_embeddings, parse_legacy_embeddings
+
+    cursor = conn.cursor()
+    columns = _columns(cursor, table)
+    if not columns:
+        print(f"Table {table} does not exist yet.")
+        return
+    if "vector" not in columns:
+        print(f"Table {table} already uses binary embeddings.")
+        return
+
+    # Check every row before changing anything: `vector` is NOT NULL and the app no longer
+    # writes it, so the migration has to end by dropping it or leave the table as it was
+    pending = "WHERE embedding IS NULL" if "embedding" in columns else ""
+    unconvertible = []
+    for row_id, vector in conn.execute(f"SELECT id, vector FROM {table} {pending} ORDER BY id"):
+        try:
+            parse_legacy_embeddings(vector)
+        except (ValueError, TypeError) as exc:
+            print(f"  {table} row {row_id}: cannot convert ({exc})")
+            unconvertible.append(row_id)
+    if unconvertible:
+        raise MigrationError(
+            f"{len(unconvertible)} row(s) in {table} could not be converted; nothing was changed. "
+            f"Fix or delete those rows (ids {', '.join(map(str, unconvertible[:20]))}) and run again."
+        )
+
+    if "embedding" not in columns:
+        print(f"Adding embedding columns to {table}...")
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN embedding BLOB")
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN sample_count INTEGER DEFAULT 0 NOT NULL")
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN model_version VARCHAR")
+        conn.commit()
+
+    converted = 0
+    last_id = 0
+    while True:
+        cursor.execute(
+            f"SELECT id, vector FROM {table} WHERE embedding IS NULL AND id > ? ORDER BY id LIMIT ?",
+            (last_id, batch_size),
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        updates = []
+        for row_id, vector in rows:
+            last_id = row_id
+            samples = parse_legacy_embeddings(vector)
+            updates.append((pack_embeddings(samples), len(samples), MODEL_VERSION, row_id))
+        cursor.executemany(
+            f"UPDATE {table} SET embedding = ?, sample_count = ?, model_version = ? WHERE id = ?",
+            updates,
+        )
+        conn.commit()
+        converted += len(updates)
+        print(f"  {table}: converted {converted} row(s) so far")
+
+    cursor.execute(f"ALTER TABLE {table} DROP COLUMN vector")
+    conn.commit()
+    print(f"Migrated {converted} row(s) in {table} to binary embeddings.")
+
+
+def migrate_face_review_images(conn, batch_size=DEFAULT_BATCH_SIZE):
+    """Columns for out-of-database review previews, then move existing inline previews to the image store."""
+    sys.path.append(str(ROOT))
+    from app.image_store import face_image_store
+
+    cursor = conn.cursor()
+    columns = _columns(cursor, "faceupdaterequest")
+    if not columns:
+        print("Table faceupdaterequest does not exist yet.")
+        return
+    if "image_digest" in columns:
+        print("Column image_digest already exists.")
+    else:
+        print("Adding image_digest and decided_at columns...")
+        cursor.execute("ALTER TABLE faceupdaterequest ADD COLUMN image_digest VARCHAR")
+        cursor.execute("ALTER TABLE faceupdaterequest ADD COLUMN decided_at DATETIME")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_faceupdaterequest_image_digest ON faceupdaterequest (image_digest)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_faceupdaterequest_status ON faceupdaterequest (status)")
+        conn.commit()
+        print("Migration successful.")
+    if "image_data" not in columns:
+        return
+
+    # Each batch commits on its own; files already written for a batch that didn't commit are
+    # content-addressed, so a rerun stores them under the same digest
+    moved = 0
+    while True:
+        cursor.execute(
+            "SELECT id, image_data FROM faceupdaterequest WHERE image_data != '' AND image_digest IS NULL LIMIT ?",
+            (batch_size,),
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        updates = []
+        for row_id, image_data in rows:
+            try:
+                digest = face_image_store.put(image_data)
+            except (ValueError, TypeError):
+                digest = None  # unreadable legacy data; nothing worth keeping
+            updates.append((digest, row_id))
+        cursor.executemany("UPDATE faceupdaterequest SET image_digest = ?, image_data = '' WHERE id = ?", updates)
+        conn.commit()
+        moved += len(updates)
+    if moved:
+        print(f"Moved {moved} inline preview(s) to {face_image_store.root}.")
+
+
+def migrate_face_duplicates(conn):
+    """Duplicate-identity flag on face requests; requests filed before this stay unflagged."""
+    cursor = conn.cursor()
+    columns = _columns(cursor, "faceupdaterequest")
+    if not columns:
+        print("Table faceupdaterequest does not exist yet.")
+        return
+    if "duplicate_user_id" in columns:
+        print("Column duplicate_user_id already exists.")
+        return
+    print("Adding duplicate_user_id and duplicate_score columns...")
+    cursor.execute("ALTER TABLE faceupdaterequest ADD COLUMN duplicate_user_id INTEGER")
+    cursor.execute("ALTER TABLE faceupdaterequest ADD COLUMN duplicate_score FLOAT")
+    conn.commit()
+    print("Migration successful.")
+
+
+def migrate(batch_size=DEFAULT_BATCH_SIZE):
+    """Returns the process exit code: 0 when every migration applied (or was already applied)."""
     if not DB_PATH.exists():
         print("Database not found.")
-        return
+        return 0
 
     conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
+
     try:
-        # Check if column exists
-        cursor.execute("PRAGMA table_info(attendancesession)")
-        columns = [info[1] for info in cursor.fetchall()]
-        
-        if "session_number" not in columns:
-            print("Adding session_number column...")
-            cursor.execute("ALTER TABLE attendancesession ADD COLUMN session_number INTEGER DEFAULT 1 NOT NULL")
-            conn.commit()
-            print("Migration successful.")
-        else:
-            print("Column session_number already exists.")
-            
+        migrate_session_number(conn)
+        for table in FACE_TABLES:
+            migrate_face_vectors(conn, table, batch_size)
+        migrate_face_review_images(conn, batch_size)
+        migrate_face_duplicates(conn)
     except Exception as e:
         print(f"Migration failed: {e}")
+        return 1
     finally:
         conn.close()
+    return 0
 
 if __name__ == "__main__":
-    migrate()
+    parser = argparse.ArgumentParser(description="Apply schema migrations to attendance.db")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--db", default=str(DB_PATH))
+    args = parser.parse_args()
+    DB_PATH = Path(args.db)
+    sys.exit(migrate(args.batch_size))
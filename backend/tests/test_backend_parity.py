@@ -0,0 +1,100 @@
+"""
+Model-level parity tests: align_face against OpenCV's FaceRecognizerSF.alignCrop, and the
+recognition backends against each other and against their own single-crop output. They need
+the ONNX files in backend/models and are skipped without them.
+
+    python -m unittest discover -s tests
+"""
+import os
+import sys
+import unittest
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import face_service  # noqa: E402
+from app.inference_backends import create_recognition_backend  # noqa: E402
+from app.quantization import normalize_rows  # noqa: E402
+from benchmark_face import synthetic_face_row, synthetic_image  # noqa: E402
+
+# Largest allowed element difference between unit-length embeddings, as in check_backend_parity.py
+TOLERANCE = 1e-3
+
+
+def models_present():
+    return os.path.exists(face_service.ARCFACE_PATH) and os.path.exists(face_service.YUNET_PATH)
+
+
+def face_rows(width, height, count, seed=0):
+    """Landmark rows around the synthetic face, jittered, scaled and rotated so every transform term is exercised."""
+    rng = np.random.default_rng(seed)
+    base = synthetic_face_row(width, height)
+    center = base[:2] + base[2:4] / 2
+    rows = []
+    for _ in range(count):
+        row = base.copy()
+        angle = np.deg2rad(rng.uniform(-25, 25))
+        rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        landmarks = (row[4:14].reshape(5, 2) - center) @ rotation.T * rng.uniform(0.6, 1.4) + center
+        row[4:14] = (landmarks + rng.normal(0, 3, landmarks.shape)).ravel()
+        rows.append(row.astype(np.float32))
+    return rows
+
+
+@unittest.skipUnless(models_present(), f"face models not found in {face_service.MODELS_DIR}")
+class AlignFaceTest(unittest.TestCase):
+    def test_matches_opencv_align_crop(self):
+        recognizer = cv2.FaceRecognizerSF.create(face_service.ARCFACE_PATH, "")
+        for seed in range(20):
+            image = synthetic_image(1280, 720, seed)
+            for face in face_rows(1280, 720, 5, seed):
+                expected = recognizer.alignCrop(image, face)
+                actual = face_service.align_face(image, face)
+                self.assertEqual(actual.shape, expected.shape)
+                # Float64 vs float32 transform: at most one grey level of rounding
+                self.assertLessEqual(int(np.abs(actual.astype(int) - expected).max()), 1)
+
+    def test_degenerate_landmarks(self):
+        face = synthetic_face_row(640, 480)
+        face[4:14] = np.tile(face[4:6], 5)
+        with self.assertRaises(ValueError):
+            face_service.align_face(synthetic_image(640, 480), face)
+
+
+@unittest.skipUnless(models_present(), f"face models not found in {face_service.MODELS_DIR}")
+class RecognitionBackendParityTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Different frames per row, so a batch that mixes up row order can't pass
+        cls.crops = [face_service.align_face(synthetic_image(640, 480, seed), synthetic_face_row(640, 480)) for seed in range(6)]
+
+    def embed(self, backend, crops):
+        return normalize_rows(backend.embed(crops).astype(np.float32))
+
+    def assertRowsClose(self, expected, actual):
+        self.assertEqual(actual.shape, expected.shape)
+        row_diffs = np.abs(expected - actual).max(axis=1)
+        self.assertTrue((row_diffs <= TOLERANCE).all(), f"rows {np.flatnonzero(row_diffs > TOLERANCE)} differ: {row_diffs}")
+
+    def backend(self, name):
+        try:
+            return create_recognition_backend(name, face_service.ARCFACE_PATH)
+        except RuntimeError as exc:  # onnxruntime not installed
+            self.skipTest(str(exc))
+
+    def test_batched_matches_single_crop(self):
+        for name in ("opencv", "onnxruntime"):
+            with self.subTest(backend=name):
+                backend = self.backend(name)
+                single = np.vstack([self.embed(backend, [crop]) for crop in self.crops])
+                self.assertRowsClose(single, self.embed(backend, self.crops))
+
+    def test_opencv_matches_onnxruntime(self):
+        expected = self.embed(self.backend("opencv"), self.crops)
+        self.assertRowsClose(expected, self.embed(self.backend("onnxruntime"), self.crops))
+
+
+if __name__ == "__main__":
+    unittest.main()
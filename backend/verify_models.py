@@ -5,15 +5,15 @@ import os
 sys.path.append(os.getcwd())
 
 try:
-    from app.face_service import _get_face_detector, _get_face_recognizer
+    from app.face_service import _get_face_detector, _get_recognition_backend
     
     print("Loading Face Detector (YuNet)...")
     detector = _get_face_detector()
     print(f"Detector loaded: {detector}")
     
-    print("Loading Face Recognizer (ArcFace)...")
-    recognizer = _get_face_recognizer()
-    print(f"Recognizer loaded: {recognizer}")
+    print("Loading Face Recognizer (SFace)...")
+    backend = _get_recognition_backend()
+    print(f"Backend loaded: {backend.name}")
     
     print("Verification Successful: All models loaded.")
 except Exception as e:
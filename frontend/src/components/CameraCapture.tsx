@@ -7,6 +7,8 @@ interface Props {
   label?: string;
   description?: string;
   captureLabel?: string;
+  burstSize?: number;
+  burstIntervalMs?: number;
 }
 
 export function CameraCapture({
@@ -15,17 +17,22 @@ export function CameraCapture({
   label = "Camera",
   description,
   captureLabel = "Capture",
+  burstSize = 1,
+  burstIntervalMs = 150,
 }: Props) {
   const webcamRef = useRef<Webcam>(null);
   const [streamState, setStreamState] = useState<"idle" | "ready" | "error">("idle");
 
   const handleCapture = useCallback(async () => {
     if (busy) return;
-    const screenshot = webcamRef.current?.getScreenshot();
-    if (screenshot) {
-      await onCapture(screenshot);
+    for (let shot = 0; shot < burstSize; shot++) {
+      if (shot > 0) await new Promise((resolve) => setTimeout(resolve, burstIntervalMs));
+      const screenshot = webcamRef.current?.getScreenshot();
+      if (screenshot) {
+        await onCapture(screenshot);
+      }
     }
-  }, [busy, onCapture]);
+  }, [busy, onCapture, burstSize, burstIntervalMs]);
 
   return (
     <div className="space-y-4 rounded-3xl border border-slate-100 bg-white p-4 shadow-sm">
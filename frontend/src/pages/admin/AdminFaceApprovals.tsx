@@ -7,27 +7,49 @@ interface FaceRequest {
     user_id: number;
     user_name: string;
     user_email: string;
-    image_data: string;
+    thumbnail_url: string | null;
+    image_url: string | null;
     created_at: string;
+    duplicate_user_id: number | null;
+    duplicate_user_name: string | null;
+    duplicate_user_email: string | null;
+    duplicate_score: number | null;
 }
 
+const PAGE_SIZE = 12;
+
+// Preview URLs are signed paths on the API server; <img> can't send the auth header
+const apiUrl = (path: string | null) => (path ? `${client.defaults.baseURL ?? ""}${path}` : undefined);
+
 export function FaceApprovalsContent() {
     const [requests, setRequests] = useState<FaceRequest[]>([]);
+    const [total, setTotal] = useState(0);
+    const [page, setPage] = useState(1);
     const [loading, setLoading] = useState(false);
     const [toast, setToast] = useState<{ message: string; type: "success" | "error" } | null>(null);
 
-    const fetchRequests = async () => {
+    const fetchRequests = async (targetPage = page) => {
         try {
-            const { data } = await client.get("/admin/face-requests");
-            setRequests(data);
+            const { data } = await client.get("/admin/face-requests", {
+                params: { page: targetPage, page_size: PAGE_SIZE },
+            });
+            // Deciding the last request on a page leaves it empty; step back a page
+            if (data.items.length === 0 && targetPage > 1) {
+                setPage(targetPage - 1);
+                return;
+            }
+            setRequests(data.items);
+            setTotal(data.total);
         } catch (error) {
             console.error("Failed to fetch requests", error);
         }
     };
 
     useEffect(() => {
-        fetchRequests();
-    }, []);
+        fetchRequests(page);
+    }, [page]);
+
+    const pageCount = Math.max(1, Math.ceil(total / PAGE_SIZE));
 
     const handleAction = async (id: number, action: "approve" | "reject") => {
         setLoading(true);
@@ -35,8 +57,11 @@ export function FaceApprovalsContent() {
             await client.post(`/admin/face-requests/${id}/${action}`);
             setToast({ message: `Request ${action}d successfully`, type: "success" });
             fetchRequests();
-        } catch (error) {
-            setToast({ message: `Failed to ${action} request`, type: "error" });
+        } catch (error: any) {
+            const detail = error.response?.data?.detail;
+            setToast({ message: detail ?? `Failed to ${action} request`, type: "error" });
+            // 409: a new duplicate was found on approval; reload to show the flag
+            if (error.response?.status === 409) fetchRequests();
         } finally {
             setLoading(false);
         }
@@ -61,7 +86,7 @@ export function FaceApprovalsContent() {
                 <div className="mb-6 flex items-center justify-between">
                     <h2 className="text-lg font-bold text-slate-800">Pending Requests</h2>
                     <span className="rounded-full bg-brand-50 px-3 py-1 text-xs font-bold text-brand-600">
-                        {requests.length} Pending
+                        {total} Pending
                     </span>
                 </div>
 
@@ -69,13 +94,21 @@ export function FaceApprovalsContent() {
                     <div className="grid gap-6 md:grid-cols-2 lg:grid-cols-3">
                         {requests.map((req) => (
                             <div key={req.id} className="group relative overflow-hidden rounded-2xl border border-slate-200 bg-white p-5 shadow-sm transition-all hover:shadow-lg">
-                                <div className="mb-4 aspect-square w-full overflow-hidden rounded-xl bg-slate-100">
-                                    <img
-                                        src={req.image_data}
-                                        alt="Face Preview"
-                                        className="h-full w-full object-cover transition-transform duration-500 group-hover:scale-105"
-                                    />
-                                </div>
+                                <a
+                                    href={apiUrl(req.image_url)}
+                                    target="_blank"
+                                    rel="noreferrer"
+                                    className="mb-4 block aspect-square w-full overflow-hidden rounded-xl bg-slate-100"
+                                >
+                                    {req.thumbnail_url && (
+                                        <img
+                                            src={apiUrl(req.thumbnail_url)}
+                                            alt="Face Preview"
+                                            loading="lazy"
+                                            className="h-full w-full object-cover transition-transform duration-500 group-hover:scale-105"
+                                        />
+                                    )}
+                                </a>
 
                                 <div className="mb-4">
                                     <h3 className="text-base font-bold text-slate-900">{req.user_name}</h3>
@@ -83,6 +116,13 @@ export function FaceApprovalsContent() {
                                     <p className="mt-1 text-xs text-slate-400">
                                         Requested: {new Date(req.created_at).toLocaleDateString()}
                                     </p>
+                                    {req.duplicate_user_id !== null && (
+                                        <p className="mt-2 rounded-lg border border-amber-200 bg-amber-50 px-2 py-1 text-xs font-medium text-amber-800">
+                                            Resembles {req.duplicate_user_name ?? `user #${req.duplicate_user_id}`}
+                                            {req.duplicate_user_email && ` (${req.duplicate_user_email})`}
+                                            {req.duplicate_score !== null && ` · score ${req.duplicate_score.toFixed(2)}`}
+                                        </p>
+                                    )}
                                 </div>
 
                                 <div className="grid grid-cols-2 gap-3">
@@ -110,6 +150,28 @@ export function FaceApprovalsContent() {
                         <p className="text-xs text-slate-500 mt-1">All face updates have been processed.</p>
                     </div>
                 )}
+
+                {pageCount > 1 && (
+                    <div className="mt-6 flex items-center justify-between text-xs font-medium text-slate-600">
+                        <button
+                            onClick={() => setPage(page - 1)}
+                            disabled={page <= 1}
+                            className="rounded-lg border border-slate-200 px-3 py-1.5 hover:bg-slate-50 disabled:opacity-50"
+                        >
+                            Previous
+                        </button>
+                        <span>
+                            Page {page} of {pageCount}
+                        </span>
+                        <button
+                            onClick={() => setPage(page + 1)}
+                            disabled={page >= pageCount}
+                            className="rounded-lg border border-slate-200 px-3 py-1.5 hover:bg-slate-50 disabled:opacity-50"
+                        >
+                            Next
+                        </button>
+                    </div>
+                )}
             </div>
         </div>
     );
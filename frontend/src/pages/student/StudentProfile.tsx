@@ -2,6 +2,10 @@ import { useState, useEffect } from "react";
 import client from "../../api/client";
 import { CameraCapture } from "../../components/CameraCapture";
 
+// One burst of frames per capture; the server keeps the best REQUIRED_SAMPLES of them
+const BURST_SIZE = 10;
+const REQUIRED_SAMPLES = 3;
+
 interface Props {
     hasFace: boolean;
     sampleCount: number;
@@ -24,16 +28,16 @@ export function StudentProfile({ hasFace, sampleCount, onEnrollmentUpdate }: Pro
 
     const handleQueueCapture = (imageData: string) => {
         setQueuedSamples((prev) => {
-            if (prev.length >= 3) return prev;
+            if (prev.length >= BURST_SIZE) return prev;
             const next = [...prev, imageData];
-            setCaptureStatus({ variant: "info", message: `Captured sample ${next.length}/3` });
+            setCaptureStatus({ variant: "info", message: `Captured frame ${next.length}/${BURST_SIZE}` });
             return next;
         });
     };
 
     const handleSaveSamples = async () => {
-        if (queuedSamples.length < 3) {
-            setCaptureStatus({ variant: "error", message: "Capture 3 samples before saving." });
+        if (queuedSamples.length < REQUIRED_SAMPLES) {
+            setCaptureStatus({ variant: "error", message: `Capture at least ${REQUIRED_SAMPLES} frames before saving.` });
             return;
         }
         setCameraBusy(true);
@@ -45,7 +49,7 @@ export function StudentProfile({ hasFace, sampleCount, onEnrollmentUpdate }: Pro
             if (data.status === "PENDING") {
                 setCaptureStatus({ variant: "info", message: "Face update pending admin approval." });
             } else {
-                setCaptureStatus({ variant: "success", message: `${message} (${data.samples}/3)` });
+                setCaptureStatus({ variant: "success", message: `${message} (${data.samples}/${REQUIRED_SAMPLES})` });
             }
 
             setQueuedSamples([]);
@@ -93,7 +97,7 @@ export function StudentProfile({ hasFace, sampleCount, onEnrollmentUpdate }: Pro
                         <h2 className="text-xl font-bold text-slate-800">Face Enrollment</h2>
                     </div>
                     <p className="text-sm text-slate-500 leading-relaxed">
-                        Capture 3 clear photos of your face to enable automated attendance. Ensure good lighting and look directly at the camera.
+                        Capture a short burst of photos of your face to enable automated attendance; the clearest {REQUIRED_SAMPLES} are kept. Ensure good lighting and look directly at the camera.
                     </p>
                 </div>
 
@@ -104,16 +108,17 @@ export function StudentProfile({ hasFace, sampleCount, onEnrollmentUpdate }: Pro
                             description=""
                             busy={cameraBusy}
                             onCapture={handleQueueCapture}
-                            captureLabel={`Capture Photo (${queuedSamples.length}/3)`}
+                            burstSize={BURST_SIZE - queuedSamples.length}
+                            captureLabel={`Capture Burst (${queuedSamples.length}/${BURST_SIZE})`}
                         />
                         <div className="absolute top-4 right-4 bg-black/50 backdrop-blur-md text-white text-xs font-bold px-3 py-1 rounded-full border border-white/20">
-                            {queuedSamples.length}/3 Captured
+                            {queuedSamples.length}/{BURST_SIZE} Captured
                         </div>
                     </div>
 
                     <div className="space-y-6">
-                        <div className="grid grid-cols-3 gap-4">
-                            {[0, 1, 2].map((idx) => (
+                        <div className="grid grid-cols-5 gap-3">
+                            {Array.from({ length: BURST_SIZE }, (_, idx) => (
                                 <div key={idx} className={`aspect-square rounded-2xl border-2 ${queuedSamples[idx] ? "border-emerald-500 shadow-md" : "border-dashed border-slate-200 bg-slate-50"} flex items-center justify-center overflow-hidden relative transition-all`}>
                                     {queuedSamples[idx] ? (
                                         <>
@@ -136,7 +141,7 @@ export function StudentProfile({ hasFace, sampleCount, onEnrollmentUpdate }: Pro
                             <button
                                 className="w-full rounded-2xl bg-brand-600 px-4 py-4 text-sm font-bold text-white shadow-lg shadow-brand-500/30 transition-all hover:bg-brand-700 hover:shadow-brand-600/40 active:scale-[0.98] disabled:opacity-50 disabled:cursor-not-allowed disabled:shadow-none"
                                 onClick={handleSaveSamples}
-                                disabled={cameraBusy || queuedSamples.length < 3}
+                                disabled={cameraBusy || queuedSamples.length < REQUIRED_SAMPLES}
                             >
                                 {cameraBusy ? "Uploading..." : "Complete Enrollment"}
                             </button>
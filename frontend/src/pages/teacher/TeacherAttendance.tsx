@@ -109,7 +109,11 @@ export function TeacherAttendance({ offerings }: Props) {
         setCameraBusy(true);
         setVerificationStatus({ message: "Uploading frame for verification…", variant: "info" });
         try {
-            const { data } = await client.post(`/attendance/${sessionId}/verify-face`, { image_data: imageData });
+            // Send the JPEG as raw bytes instead of a base64 data URL inside JSON
+            const frame = await (await fetch(imageData)).blob();
+            const { data } = await client.post(`/attendance/${sessionId}/verify-face`, frame, {
+                headers: { "Content-Type": "application/octet-stream" },
+            });
 
             setProbeEmbedding(data.probe_embedding || null);
             setMatchedEmbedding(data.matched_embedding || null);